@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Functions called from Excel, each is imported in a fresh interpreter as xlwings does on a cold start
+ENTRY_POINTS = {
+    "main": "from portfolio_tracker.run import main",
+    "update_budget": "from portfolio_tracker.budget_utils import update_budget",
+    "import_csv": "from portfolio_tracker.budget import import_csv",
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(statement: str):
+    # Cumulative import time of every module in microseconds, as reported by -X importtime
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, env=env, check=True
+    )
+    modules, total = {}, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules[name.strip()] = int(cumulative)
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return total, modules
+
+
+def benchmark(repeat: int, top: int):
+    report = {}
+    for entry_point, statement in ENTRY_POINTS.items():
+        runs = [measure_import(statement) for _ in range(repeat)]
+        totals = [total for total, _ in runs]
+        heaviest = sorted(runs[-1][1].items(), key=lambda item: item[1], reverse=True)[:top]
+        report[entry_point] = {
+            "median_ms": statistics.median(totals) / 1000,
+            "min_ms": min(totals) / 1000,
+            "heaviest_modules_ms": {name: cumulative / 1000 for name, cumulative in heaviest},
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of each entry point called from Excel.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of heaviest modules to list per entry point.")
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    parser.add_argument(
+        "--baseline", help="JSON report of a previous run, entry points slower than it by --tolerance fail the run."
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = benchmark(args.repeat, args.top)
+    for entry_point, result in report.items():
+        print(f"{entry_point:15s} median {result['median_ms']:8.1f} ms   min {result['min_ms']:8.1f} ms")
+        for name, cumulative in result["heaviest_modules_ms"].items():
+            print(f"    {cumulative:8.1f} ms  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = [
+            entry_point
+            for entry_point, result in report.items()
+            if entry_point in baseline and result["min_ms"] > baseline[entry_point]["min_ms"] * (1 + args.tolerance)
+        ]
+        if regressions:
+            print(f"Import time regressed for: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
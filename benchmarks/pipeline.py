@@ -0,0 +1,201 @@
+import argparse
+import contextlib
+import datetime as dt
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from portfolio_tracker.constant import MARKET_MAP, MovementColumns, OrderColumns, Side  # noqa: E402
+from portfolio_tracker.core import (  # noqa: E402
+    aggregate_orders_to_portfolio_df,
+    build_cash_accounts_summary,
+    build_portfolio_analytics,
+    build_portfolio_summary,
+)
+from portfolio_tracker.fx import FxMatrix, set_fx_matrix  # noqa: E402
+from portfolio_tracker.ledger import Ledger  # noqa: E402
+from portfolio_tracker.portfolio_utils import compute_portfolio_returns_over_time  # noqa: E402
+from portfolio_tracker.prefetch import prefetch_market_data  # noqa: E402
+from portfolio_tracker.providers import ReplayProvider, get_fx_sym, set_provider  # noqa: E402
+from portfolio_tracker.timeline import Timelines  # noqa: E402
+
+# Instruments are spread over these markets, quoted in the market's currency
+MARKETS = {"XNAS": "USD", "XLON": "GBp", "XPAR": "EUR"}
+BOOK_CURRENCIES = ["USD", "GBP", "EUR"]
+REPORTING_CURRENCY = "EUR"
+
+
+def generate_provider(symbols: List[Tuple[str, str]], start_date: pd.Timestamp, seed: int) -> ReplayProvider:
+    # Geometric random walks with a quarterly dividend, and USD-based FX rates around a fixed level
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start_date, dt.date.today())
+    provider = ReplayProvider()
+    for sym, market in symbols:
+        tkr = sym + (f".{MARKET_MAP[market]}" if market in MARKET_MAP else "")
+        close = rng.uniform(10, 500) * np.exp(np.cumsum(rng.normal(0.0002, 0.015, len(dates))))
+        dividends = np.where(np.arange(len(dates)) % 63 == 0, close * 0.005, 0.0)
+        provider.add_history(tkr, pd.DataFrame({"Close": close, "Dividends": dividends}, index=dates))
+        provider.add_info(tkr, {"longName": f"{sym} Corp", "currency": MARKETS[market]})
+    for currency, level in {"EUR": 0.9, "GBP": 0.8}.items():
+        close = level * np.exp(np.cumsum(rng.normal(0, 0.003, len(dates))))
+        provider.add_history(get_fx_sym("USD", currency), pd.DataFrame({"Close": close}, index=dates))
+    return provider
+
+
+def generate_workload(
+    n_portfolios: int, n_symbols: int, n_orders: int, years: int, seed: int = 0
+) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, str], ReplayProvider]:
+    rng = np.random.default_rng(seed)
+    start_date = pd.Timestamp(dt.date.today()) - pd.DateOffset(years=years)
+    markets = list(MARKETS)
+    symbols = [(f"S{i:05d}", markets[i % len(markets)]) for i in range(n_symbols)]
+    portfolios = [f"BOOK_{i}" for i in range(n_portfolios)]
+    book_currencies = {key: BOOK_CURRENCIES[i % len(BOOK_CURRENCIES)] for i, key in enumerate(portfolios)}
+
+    order_dates = pd.bdate_range(start_date, dt.date.today() - dt.timedelta(days=1)).to_numpy()
+    instrument = rng.integers(len(symbols), size=n_orders)
+    quantity = rng.integers(1, 100, size=n_orders).astype(float)
+    unit_cost = rng.uniform(10, 500, size=n_orders).round(2)
+    fees = rng.uniform(0, 5, size=n_orders).round(2)
+    order_data = pd.DataFrame(
+        {
+            OrderColumns.date.value: np.sort(rng.choice(order_dates, size=n_orders)),
+            OrderColumns.portfolio.value: np.asarray(portfolios)[rng.integers(n_portfolios, size=n_orders)],
+            OrderColumns.sym.value: [symbols[i][0] for i in instrument],
+            OrderColumns.market.value: [symbols[i][1] for i in instrument],
+            OrderColumns.side.value: np.where(rng.random(n_orders) < 0.8, Side.buy.value, Side.sell.value),
+            OrderColumns.qty.value: quantity,
+            OrderColumns.unit_cost.value: unit_cost,
+            OrderColumns.book_cost.value: quantity * unit_cost,
+            OrderColumns.fees.value: fees,
+            OrderColumns.taxes.value: 0.0,
+            OrderColumns.total_cost.value: quantity * unit_cost + fees,
+        }
+    )
+
+    accounts = portfolios + ["CASH_EUR", "CASH_USD"]
+    currencies = [book_currencies[key] for key in portfolios] + ["EUR", "USD"]
+    n_movements = max(len(accounts), n_orders // 10)
+    account = np.concatenate([np.arange(len(accounts)), rng.integers(len(accounts), size=n_movements - len(accounts))])
+    deposit = np.concatenate([np.ones(len(accounts), dtype=bool), rng.random(n_movements - len(accounts)) < 0.7])
+    mvt_data = pd.DataFrame(
+        {
+            MovementColumns.date.value: np.concatenate(
+                [np.full(len(accounts), order_dates[0]), rng.choice(order_dates, size=n_movements - len(accounts))]
+            ),
+            MovementColumns.account.value: np.asarray(accounts)[account],
+            MovementColumns.side.value: np.where(deposit, Side.deposit.value, Side.withdrawal.value),
+            MovementColumns.qty.value: np.where(deposit, 1e6, 1e3) * rng.random(n_movements).round(4),
+            MovementColumns.type.value: np.where(deposit, "Deposit", "Withdrawal"),
+            MovementColumns.currency.value: np.asarray(currencies)[account],
+        }
+    ).sort_values(MovementColumns.date.value, ignore_index=True)
+
+    provider = generate_provider(symbols, start_date - pd.DateOffset(days=10), seed)
+    return order_data, mvt_data, book_currencies, provider
+
+
+def measure(stage: Callable, track_memory: bool):
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = stage()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_pipeline(order_data, mvt_data, book_currencies, track_memory: bool) -> Dict[str, Dict]:
+    # The stages of run.run_portfolios that do not write to a workbook, in the same order
+    timings = {}
+
+    def stage(name, fn):
+        result, elapsed, peak = measure(fn, track_memory)
+        timings[name] = {"seconds": elapsed, "peak_mb": None if peak is None else peak / 2**20}
+        return result
+
+    orders = stage("build_ledger", lambda: Ledger(order_data, OrderColumns))
+    movements = Ledger(mvt_data, MovementColumns)
+    stage(
+        "prefetch_market_data",
+        lambda: prefetch_market_data(orders.df, movements.df, book_currencies, REPORTING_CURRENCY),
+    )
+    # Instrument timelines are shared by the stages below, as they are by the stages of a run
+    timelines = Timelines(orders)
+    portfolios = stage(
+        "aggregate_orders_to_portfolio_df", lambda: aggregate_orders_to_portfolio_df(orders, timelines=timelines)
+    )
+    stage(
+        "build_portfolio_analytics",
+        lambda: {key: build_portfolio_analytics(df, book_currencies[key], timelines) for key, df in portfolios.items()},
+    )
+    returns = stage(
+        "compute_portfolio_returns_over_time",
+        lambda: {
+            key: compute_portfolio_returns_over_time(
+                orders.select(key, OrderColumns.portfolio.value), book_currencies[key], timelines
+            )
+            for key in portfolios
+        },
+    )
+    stage(
+        "build_cash_accounts_summary",
+        lambda: build_cash_accounts_summary(movements, orders, portfolios, book_currencies, REPORTING_CURRENCY),
+    )
+    stage(
+        "build_portfolio_summary",
+        lambda: build_portfolio_summary(orders, portfolios, book_currencies, REPORTING_CURRENCY, returns),
+    )
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the core pipeline on synthetic orders and generated prices, without network access."
+    )
+    parser.add_argument("--orders", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--portfolios", type=int, default=3)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Do not trace allocations, tracing slows the stages down."
+    )
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    report = {}
+    for n_orders in args.orders:
+        order_data, mvt_data, book_currencies, provider = generate_workload(
+            args.portfolios, args.symbols, n_orders, args.years, args.seed
+        )
+        set_provider(provider)
+        set_fx_matrix(FxMatrix())
+        timings = run_pipeline(order_data, mvt_data, book_currencies, not args.no_memory)
+        report[n_orders] = timings
+
+        print(f"{n_orders} orders, {args.portfolios} portfolios, {args.symbols} symbols, {args.years} years")
+        for name, result in timings.items():
+            peak = "" if result["peak_mb"] is None else f"{result['peak_mb']:10.1f} MB"
+            print(f"    {name:40s} {result['seconds']:8.3f} s {peak}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,115 @@
-import xlwings as xw
+from typing import Callable, Optional
+
+import numpy as np
 import pandas as pd
-import tkinter as tk
-from tkinter import filedialog
-from tkinter import ttk
-import tkinter as tk
-from tkinter import filedialog
-
-from portfolio_tracker.constant import BudgettingColumns
-from portfolio_tracker.utils import read_table
+
 from portfolio_tracker.budget_utils import (
-    get_income,
-    get_expenses,
-    plot_income_category,
-    plot_expenses_category,
+    BudgetDateParser,
+    load_budget_cube,
     preprocess_budget_data,
+    save_budget_cube,
+    table_row_hashes,
 )
+from portfolio_tracker.constant import IMPORT_CHUNK_SIZE
+from portfolio_tracker.store import RowHashIndex, get_row_hash_index, rows_signature
+from portfolio_tracker.utils import count_table_rows, read_table, read_table_values, row_hashes
 
 
 def import_csv():
+    import xlwings as xw
+
     wb = xw.Book.caller()
     budget_sheet = wb.sheets["Budget"]
-    df = read_csv()
+    file_path = ask_csv_path()
+    if not file_path:
+        return
 
-    existing_data = read_table("B2", budget_sheet, index=0, header=1)
+    # The table is read and hashed once, the budget cube follows the import and is signed with the hashes of the
+    # table and of the rows appended to it
+    values = read_table_values(budget_sheet)
+    hashes = table_row_hashes(values)
+    cube = load_budget_cube(wb.fullname, values, hashes)
+    # Every chunk of the file is read with the date format of its first one
+    parse_dates = BudgetDateParser()
+    appended = [hashes]
 
-    # Directly write to sheet if no previous data
-    if existing_data.shape[1] == 1:
-        budget_sheet.range("B2").options(index=False).value = df
-        return
+    def add_rows(rows: pd.DataFrame, new_hashes: np.ndarray):
+        cube.add(preprocess_budget_data(rows, parse_dates))
+        appended.append(new_hashes)
+
+    imported = append_csv(file_path, budget_sheet, get_row_hash_index(wb.fullname), hashes, on_append=add_rows)
+    if imported:
+        save_budget_cube(wb.fullname, cube, rows_signature(np.concatenate(appended)))
+    print(f"Imported {imported} new rows")
 
-    df.columns = existing_data.columns
-    df = pd.concat([existing_data, df], ignore_index=True).drop_duplicates(keep="first")
-    df = df.where(pd.notnull(df), None)
-    # Delete existing data and write the new data
-    budget_sheet.range("B2").expand().delete()
-    budget_sheet.range("B2").options(index=False).value = df
 
+def ask_csv_path() -> str:
+    import tkinter as tk
+    from tkinter import filedialog
 
-def read_csv():
     root = tk.Tk()
     root.withdraw()
 
     # Open a file dialog
-    file_path = filedialog.askopenfilename(filetypes=[("CSV Files", "*.csv")])
+    return filedialog.askopenfilename(filetypes=[("CSV Files", "*.csv")])
 
-    # Read the first line of the file and derive the separator and colnames
+
+def sniff_separator(file_path: str) -> str:
+    # Read the first line of the file and derive the separator
     with open(file_path, "r") as f:
         first_line = f.readline()
-        if first_line.count(",") > first_line.count(";"):
-            sep = ","
-        else:
-            sep = ";"
+    return "," if first_line.count(",") > first_line.count(";") else ";"
+
+
+def read_csv(file_path: str = None, **kwargs):
+    file_path = file_path or ask_csv_path()
+    return pd.read_csv(file_path, sep=sniff_separator(file_path), **kwargs)
+
+
+def append_csv(
+    file_path: str,
+    budget_sheet,
+    index: RowHashIndex,
+    table_hashes: Optional[np.ndarray] = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    on_append: Optional[Callable[[pd.DataFrame, np.ndarray], None]] = None,
+) -> int:
+    # Streams the CSV in chunks and appends the rows not seen before below the table at B2, so the cost follows the
+    # size of the import rather than of the whole history. `on_append` receives a copy of each block of new rows and
+    # their hashes, `table_hashes` are those of the rows already in the table when the caller has read them.
+    header = budget_sheet.range("B2").expand("right").value
+    rows = 0
+    if header is None:
+        index.rebuild(np.empty(0, dtype=np.int64), 0)
+    else:
+        header = header if isinstance(header, list) else [header]
+        rows = count_table_rows(budget_sheet)
+        # The table was edited since the last import, the index is rebuilt from its current content
+        if index.rows != rows:
+            if table_hashes is None:
+                table_hashes = row_hashes(read_table("B2", budget_sheet, index=0, header=1))
+            index.rebuild(table_hashes, rows)
+
+    imported = 0
+    for chunk in pd.read_csv(file_path, sep=sniff_separator(file_path), chunksize=chunk_size):
+        # Directly write the header to the sheet if no previous data
+        if header is None:
+            header = chunk.columns.tolist()
+            budget_sheet.range("B2").value = header
+        chunk.columns = header
 
-    df = pd.read_csv(file_path, sep=sep)
+        hashes = row_hashes(chunk)
+        new = ~index.contains(hashes) & ~pd.Series(hashes).duplicated().to_numpy()
+        if not new.any():
+            continue
 
-    return df
+        chunk = chunk[new]
+        if on_append is not None:
+            on_append(chunk.copy(), hashes[new])
+        chunk = chunk.astype(object)
+        chunk = chunk.where(pd.notnull(chunk), None)
+        budget_sheet.range((3 + rows, 2)).options(index=False, header=False).value = chunk
+        rows += len(chunk)
+        imported += len(chunk)
+        index.add(hashes[new], rows)
+    return imported
@@ -1,29 +1,104 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import xlwings as xw
-
-from portfolio_tracker.constant import BudgettingColumns
-from portfolio_tracker.utils import read_table
-
+import os
+from typing import Callable, List, Optional, Tuple
 
-def preprocess_budget_data(df: pd.DataFrame) -> pd.DataFrame:
-    # Convert types
-    df[BudgettingColumns.date.value] = pd.to_datetime(df[BudgettingColumns.date.value], infer_datetime_format=True)
-
-    df[BudgettingColumns.receiver.value] = df[BudgettingColumns.receiver.value].astype(str)
-    df[BudgettingColumns.category.value] = df[BudgettingColumns.category.value].astype(str)
-    df[BudgettingColumns.subcategory.value] = df[BudgettingColumns.subcategory.value].astype(str)
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+from portfolio_tracker.constant import BUDGET_DATE_FORMAT, BudgettingColumns
+from portfolio_tracker.cube import EXCLUDED_RECEIVER, EXPENSES, INCOME, BudgetCube
+from portfolio_tracker.store import get_budget_store, rows_signature, table_key, table_signature
+from portfolio_tracker.utils import row_hashes, table_values_to_frame
+from portfolio_tracker.writers import XlwingsWorkbookWriter
+
+
+# Few distinct values each, stored as categoricals
+CATEGORICAL_COLUMNS = [
+    BudgettingColumns.category.value,
+    BudgettingColumns.subcategory.value,
+    BudgettingColumns.account.value,
+    BudgettingColumns.bank.value,
+    BudgettingColumns.receiver.value,
+]
+
+
+# Dates of one source, a file or a table, parsed with one format for the whole column: the format that read the
+# source's previous dates, then the configured one, then the month-first and day-first readings of the first date.
+# A parser is shared by the chunks of a source and never by two sources.
+class BudgetDateParser:
+    def __init__(self, date_format: Optional[str] = BUDGET_DATE_FORMAT):
+        self.date_format = date_format
+
+    def __call__(self, dates: pd.Series) -> pd.Series:
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            return dates
+        first = dates.dropna().iloc[0] if dates.notna().any() else None
+        if not isinstance(first, str):
+            return pd.to_datetime(dates)
+
+        for date_format in dict.fromkeys(
+            [
+                self.date_format,
+                BUDGET_DATE_FORMAT,
+                guess_datetime_format(first),
+                guess_datetime_format(first, dayfirst=True),
+            ]
+        ):
+            if date_format is None:
+                continue
+            try:
+                parsed = pd.to_datetime(dates, format=date_format)
+            except ValueError:
+                continue
+            self.date_format = date_format
+            return parsed
+        return pd.to_datetime(dates, format="mixed")
+
+
+def parse_budget_amounts(amounts: pd.Series) -> pd.Series:
+    # Decimal commas become points, spaces between thousands are only looked for when some amounts do not parse
+    if pd.api.types.is_numeric_dtype(amounts):
+        return amounts.astype(float)
+    amounts = amounts.astype(str).str.replace(",", ".", regex=False)
+    try:
+        return amounts.astype(float)
+    except ValueError:
+        return pd.to_numeric(amounts.str.replace(r"\s", "", regex=True))
+
+
+def preprocess_budget_data(df: pd.DataFrame, parse_dates: Optional[BudgetDateParser] = None) -> pd.DataFrame:
+    # Columns already converted are left as they are, so a preprocessed frame goes through again at no cost. The
+    # chunks of one source share its `parse_dates`, a whole table gets its own.
+    parse_dates = parse_dates or BudgetDateParser()
+    df[BudgettingColumns.date.value] = parse_dates(df[BudgettingColumns.date.value])
+    df[BudgettingColumns.amount.value] = parse_budget_amounts(df[BudgettingColumns.amount.value])
+
+    for column in CATEGORICAL_COLUMNS:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.infer_dtype(df[column], skipna=False) != "string":
+            df[column] = df[column].astype(str)
+        df[column] = df[column].astype("category")
     df[BudgettingColumns.notes.value] = df[BudgettingColumns.notes.value].astype(str)
     df[BudgettingColumns.description.value] = df[BudgettingColumns.description.value].astype(str)
-    df[BudgettingColumns.account.value] = df[BudgettingColumns.account.value].astype(str)
-    df[BudgettingColumns.bank.value] = df[BudgettingColumns.bank.value].astype(str)
+    return df
 
-    # Convert BudgettingColumns.amount.value column to numeric after removing the space
-    df[BudgettingColumns.amount.value] = pd.to_numeric(
-        df[BudgettingColumns.amount.value].str.replace(" ", "").str.replace(",", ".")
-    )
 
+def load_budget_file(path: str, read: Callable[[], pd.DataFrame], table: str = "") -> pd.DataFrame:
+    # Preprocessed budget table read from a file (an export, or the `table` sheet of a workbook), kept in the budget
+    # store until the file is modified
+    stat = os.stat(path)
+    # The configured date format is part of the fingerprint, the dates are parsed with it
+    key = table_key(f"{os.path.abspath(path)}|{table}")
+    fingerprint = f"{stat.st_mtime_ns}|{stat.st_size}|{BUDGET_DATE_FORMAT}"
+    cached = get_budget_store().get(key, fingerprint)
+    if cached is not None:
+        return cached["transactions"]
+    df = read()
+    if df.empty:
+        return df
+    df = preprocess_budget_data(df)
+    get_budget_store().put(key, fingerprint, {"transactions": df})
     return df
 
 
@@ -47,24 +122,29 @@ def get_expenses(budget_history_df, window=None):
         return expenses
 
 
-def plot_income_category(income, sheet, subcategory=False):
+def get_budget_window(window_name):
+    match window_name:
+        case "All time":
+            return None
+        case "Last 30 days":
+            return (pd.Timestamp.now() - pd.DateOffset(days=30), pd.Timestamp.now())
+        case "Last 90 days":
+            return (pd.Timestamp.now() - pd.DateOffset(days=90), pd.Timestamp.now())
+        case "Last 180 days":
+            return (pd.Timestamp.now() - pd.DateOffset(days=180), pd.Timestamp.now())
+        case "Last 365 days":
+            return (pd.Timestamp.now() - pd.DateOffset(days=365), pd.Timestamp.now())
+        case "Year to date":
+            return (pd.Timestamp.now().replace(month=1, day=1), pd.Timestamp.now())
+        case _:
+            return None
 
-    # Remove rows where supplierFound value contain both 'antoine' and 'toffano'
-    income = income[~income[BudgettingColumns.receiver.value].str.contains("antoine toffano")]
-    # Remove all columns but subcategory, category and amount
-    income = income[
-        [BudgettingColumns.subcategory.value, BudgettingColumns.category.value, BudgettingColumns.amount.value]
-    ]
-    # Convert income to positive values
-    income[BudgettingColumns.amount.value] = income[BudgettingColumns.amount.value].abs()
+
+def draw_category_pie(grouped, title):
+    import matplotlib.pyplot as plt
 
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot(111)
-    if subcategory:
-        grouped = income.groupby(BudgettingColumns.subcategory.value)[BudgettingColumns.amount.value].sum()
-    else:
-        grouped = income.groupby(BudgettingColumns.category.value)[BudgettingColumns.amount.value].sum()
-
     grouped.plot(
         kind="pie",
         ax=ax,
@@ -77,149 +157,206 @@ def plot_income_category(income, sheet, subcategory=False):
     )
 
     # Spread textual labels
-    ax.set_title("Income by Subcategory" if subcategory else "Income by Category", fontsize=16, fontweight="bold")
+    ax.set_title(title, fontsize=16, fontweight="bold")
     ax.set_ylabel("")  # Hide the y-axis label
     ax.legend(bbox_to_anchor=(1, 1), loc="upper left")  # Move the legend outside the pie chart
-
-    sheet.pictures.add(fig, name="Income by Subcategory" if subcategory else "Income by Category", update=True)
+    return fig
 
 
-def plot_expenses_category(expenses, sheet, subcategory=False):
-
+def group_by_category(transactions, subcategory=False):
     # Remove rows where supplierFound value contain both 'antoine' and 'toffano'
-    expenses = expenses[~expenses[BudgettingColumns.receiver.value].str.contains("antoine toffano")]
-    # Remove all columns but subcategory, category and amount
-    expenses = expenses[
-        [BudgettingColumns.subcategory.value, BudgettingColumns.category.value, BudgettingColumns.amount.value]
-    ]
-    # Convert expenses to positive values
-    expenses[BudgettingColumns.amount.value] = expenses[BudgettingColumns.amount.value].abs()
-
-    fig = plt.figure(figsize=(10, 10))
-    ax = fig.add_subplot(111)
+    transactions = transactions[~transactions[BudgettingColumns.receiver.value].str.contains(EXCLUDED_RECEIVER)]
+    # Convert amounts to positive values
+    amounts = transactions[BudgettingColumns.amount.value].abs()
     if subcategory:
-        grouped = expenses.groupby(BudgettingColumns.subcategory.value)[BudgettingColumns.amount.value].sum()
-    else:
-        grouped = expenses.groupby(BudgettingColumns.category.value)[BudgettingColumns.amount.value].sum()
-    grouped.plot(
-        kind="pie",
-        ax=ax,
-        autopct="%1.1f%%",
-        startangle=190,
-        pctdistance=0.9,
-        labeldistance=1.15,
-        radius=0.8,
-        wedgeprops=dict(width=0.3, edgecolor="w"),
-    )
+        return amounts.groupby(transactions[BudgettingColumns.subcategory.value], observed=True).sum()
+    return amounts.groupby(transactions[BudgettingColumns.category.value], observed=True).sum()
 
-    # Spread textual labels
-    ax.set_title("Expenses by Subcategory" if subcategory else "Expenses by Category", fontsize=16, fontweight="bold")
-    ax.set_ylabel("")  # Hide the y-axis label
-    ax.legend(bbox_to_anchor=(1, 1), loc="upper left")  # Move the legend outside the pie chart
 
-    sheet.pictures.add(fig, name="Expenses by Subcategory" if subcategory else "Expenses by Category", update=True)
+def plot_income_category(income, sheet, subcategory=False):
+    title = "Income by Subcategory" if subcategory else "Income by Category"
+    sheet.add_chart(title, draw_category_pie, grouped=group_by_category(income, subcategory), title=title)
+
 
+def plot_expenses_category(expenses, sheet, subcategory=False):
+    title = "Expenses by Subcategory" if subcategory else "Expenses by Category"
+    sheet.add_chart(title, draw_category_pie, grouped=group_by_category(expenses, subcategory), title=title)
 
-def plot_evolving_balance(budget_history_df, sheet):
-    budget_history_df = budget_history_df.sort_values(by=BudgettingColumns.date.value)
-    budget_history_df["cumulative"] = budget_history_df[BudgettingColumns.amount.value].cumsum()
+
+def draw_evolving_balance(balance):
+    import matplotlib.pyplot as plt
 
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot(111)
 
-    budget_history_df.plot(x=BudgettingColumns.date.value, y="cumulative", ax=ax)
+    balance.plot(ax=ax)
 
     ax.set_title("Evolving Balance", fontsize=16, fontweight="bold")
     ax.set_ylabel("Balance")
     ax.set_xlabel("Date")
+    return fig
 
-    sheet.pictures.add(fig, name="Evolving Balance", update=True)
-
-
-def plot_sankey(budget_history_df, sheet):
-    # Create a new column 'amount_type' that indicates whether the amount is positive or negative
-    budget_history_df["amount_type"] = [
-        "income" if x > 0 else "expenses" for x in budget_history_df[BudgettingColumns.amount.value]
-    ]
-
-    # Create a new column 'abs_amount' that contains the absolute value of 'amount'
-    budget_history_df["abs_amount"] = budget_history_df[BudgettingColumns.amount.value].abs()
-
-    # Create the Sankey diagram
-    fig = go.Figure(
-        data=[
-            go.Sankey(
-                node=dict(
-                    pad=15,
-                    thickness=20,
-                    line=dict(color="black", width=0.5),
-                    label=budget_history_df[BudgettingColumns.subcategory.value].tolist()
-                    + budget_history_df[BudgettingColumns.category.value].tolist()
-                    + budget_history_df["amount_type"].tolist(),
-                    color="blue",
-                ),
-                link=dict(
-                    source=budget_history_df[BudgettingColumns.subcategory.value].apply(
-                        lambda x: budget_history_df[BudgettingColumns.subcategory.value].tolist().index(x)
-                    ),
-                    target=budget_history_df[BudgettingColumns.category.value].apply(
-                        lambda x: budget_history_df[BudgettingColumns.category.value].tolist().index(x)
-                    ),
-                    value=budget_history_df["abs_amount"],
-                ),
-            )
-        ]
+
+def plot_evolving_balance(budget_history_df, sheet):
+    budget_history_df = budget_history_df.sort_values(by=BudgettingColumns.date.value)
+    balance = budget_history_df.set_index(BudgettingColumns.date.value)[BudgettingColumns.amount.value].cumsum()
+    sheet.add_chart("Evolving Balance", draw_evolving_balance, balance=balance.rename("cumulative"))
+
+
+def _node_order(links: pd.DataFrame, node: str, parent: str, parent_order: List[str]) -> List[str]:
+    # Nodes grouped under the parent they send the most to, largest first, so the links cross as little as possible
+    main_links = links.loc[links.groupby(node, observed=True)["value"].idxmax()].set_index(node)
+    totals = links.groupby(node, observed=True)["value"].sum().reindex(main_links.index)
+    order = pd.DataFrame(
+        {"rank": pd.Categorical(main_links[parent], categories=parent_order).codes, "total": -totals.to_numpy()},
+        index=main_links.index,
+    )
+    return order.sort_values(["rank", "total"]).index.tolist()
+
+
+def sankey_flows(budget_history_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # Nodes (label, column) of the subcategory -> category -> income/expenses diagram in display order, and the
+    # links between them (source and target node positions, summed absolute amount), one per distinct pair
+    amount = budget_history_df[BudgettingColumns.amount.value]
+    df = budget_history_df[amount != 0]
+    amount = df[BudgettingColumns.amount.value]
+    flows = pd.DataFrame(
+        {
+            "subcategory": df[BudgettingColumns.subcategory.value].astype("category"),
+            "category": df[BudgettingColumns.category.value].astype("category"),
+            "kind": pd.Categorical(np.where(amount > 0, INCOME, EXPENSES), categories=[INCOME, EXPENSES]),
+            "value": amount.abs(),
+        }
+    )
+    paths = flows.groupby(["subcategory", "category", "kind"], observed=True)["value"].sum().reset_index()
+
+    by_category = paths.groupby(["category", "kind"], observed=True)["value"].sum().reset_index()
+    by_subcategory = paths.groupby(["subcategory", "category"], observed=True)["value"].sum().reset_index()
+    kind_order = [kind for kind in [INCOME, EXPENSES] if kind in set(paths["kind"])]
+    category_order = _node_order(by_category, "category", "kind", kind_order)
+    subcategory_order = _node_order(by_subcategory, "subcategory", "category", category_order)
+
+    nodes = pd.DataFrame(
+        {
+            "label": subcategory_order + category_order + [kind.capitalize() for kind in kind_order],
+            "column": [0] * len(subcategory_order) + [1] * len(category_order) + [2] * len(kind_order),
+        }
+    )
+
+    # Node positions are the codes of the labels in categoricals ordered like the nodes
+    category_offset, kind_offset = len(subcategory_order), len(subcategory_order) + len(category_order)
+    links = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "source": pd.Categorical(by_subcategory["subcategory"], categories=subcategory_order).codes,
+                    "target": category_offset
+                    + pd.Categorical(by_subcategory["category"], categories=category_order).codes,
+                    "value": by_subcategory["value"].to_numpy(),
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "source": category_offset
+                    + pd.Categorical(by_category["category"], categories=category_order).codes,
+                    "target": kind_offset + pd.Categorical(by_category["kind"], categories=kind_order).codes,
+                    "value": by_category["value"].to_numpy(),
+                }
+            ),
+        ],
+        ignore_index=True,
     )
+    return nodes, links.astype({"source": int, "target": int})
 
-    fig.update_layout(title_text="Sankey Diagram of Budget History", font_size=10)
-    sheet.pictures.add(fig, name="Sankey Diagram of Budget History", update=True)
 
+def plot_category_pies(cube: BudgetCube, sheet, window=None):
+    for kind, title in [(INCOME, "Income"), (EXPENSES, "Expenses")]:
+        for subcategory in [False, True]:
+            name = f"{title} by Subcategory" if subcategory else f"{title} by Category"
+            sheet.add_chart(
+                name, draw_category_pie, grouped=cube.by_category(kind, window, subcategory=subcategory), title=name
+            )
 
-def update_budget():
-    wb = xw.Book.caller()
-    budget_sheet = wb.sheets["Budget"]
-    budget_history_df = read_table("B2", budget_sheet, index=0, header=1)
-    budget_history_df = preprocess_budget_data(budget_history_df)
 
-    # Get value of dropdown menu on cell 'O2'
-    window = budget_sheet.range("O2").value
-    # Set color to gay, text color as white
-    budget_sheet.range("O2").color = (192, 192, 192)
-    budget_sheet.range("O2").api.Font.Color = -1
-    match window:
-        case "All time":
-            window = None
-        case "Last 30 days":
-            window = (pd.Timestamp.now() - pd.DateOffset(days=30), pd.Timestamp.now())
-        case "Last 90 days":
-            window = (pd.Timestamp.now() - pd.DateOffset(days=90), pd.Timestamp.now())
-        case "Last 180 days":
-            window = (pd.Timestamp.now() - pd.DateOffset(days=180), pd.Timestamp.now())
-        case "Last 365 days":
-            window = (pd.Timestamp.now() - pd.DateOffset(days=365), pd.Timestamp.now())
-        case "Year to date":
-            window = (pd.Timestamp.now().replace(month=1, day=1), pd.Timestamp.now())
-        case _:
-            window = None
-
-    # Write the budget history size to the sheet
-    income = get_income(budget_history_df, window=window)
-    expenses = get_expenses(budget_history_df, window=window)
-
-    # Write summary statistics to the sheet
-    budget_sheet.range("O4").value = "Income"
-    budget_sheet.range("O5").value = income[BudgettingColumns.amount.value].sum()
-    budget_sheet.range("P4").value = "Expenses"
-    budget_sheet.range("P5").value = expenses[BudgettingColumns.amount.value].sum()
-    budget_sheet.range("Q4").value, budget_sheet.range("Q4").color = "Net", (192, 192, 192)
-    budget_sheet.range("Q5").value = budget_sheet.range("O5").value + budget_sheet.range("P5").value
-
-    # Color Summary Statistics cells as  green/red and net based on value
-    budget_sheet.range("O4").color, budget_sheet.range("O5").color = (0, 255, 0), (0, 255, 0)
-    budget_sheet.range("P4").color, budget_sheet.range("P5").color = (255, 0, 0), (255, 0, 0)
-    budget_sheet.range("Q5").color = (0, 255, 0) if budget_sheet.range("Q5").value > 0 else (255, 0, 0)
-
-    plot_income_category(income, budget_sheet)
-    plot_income_category(income, budget_sheet, subcategory=True)
-    plot_expenses_category(expenses, budget_sheet)
-    plot_expenses_category(expenses, budget_sheet, subcategory=True)
+def render_budget_cube(cube: BudgetCube, sheet, window=None):
+    total_income, total_expenses = cube.totals(window)
+    net = total_income + total_expenses
+
+    # Write summary statistics to the sheet, colored as green/red and net based on value
+    sheet.write_value("O4", "Income", color=(0, 255, 0))
+    sheet.write_value("O5", total_income, color=(0, 255, 0))
+    sheet.write_value("P4", "Expenses", color=(255, 0, 0))
+    sheet.write_value("P5", total_expenses, color=(255, 0, 0))
+    sheet.write_value("Q4", "Net", color=(192, 192, 192))
+    sheet.write_value("Q5", net, color=(0, 255, 0) if net > 0 else (255, 0, 0))
+
+    plot_category_pies(cube, sheet, window)
+
+
+def render_budget(budget_history_df, sheet, window=None):
+    render_budget_cube(BudgetCube.from_transactions(budget_history_df), sheet, window)
+
+
+def table_row_hashes(values: List[List]) -> np.ndarray:
+    # Hashes of the rows of the table read_table_values returned, the header row left out
+    if len(values) < 2:
+        return np.empty(0, dtype=np.int64)
+    return row_hashes(table_values_to_frame(values))
+
+
+def save_budget_cube(table: str, cube: BudgetCube, signature: str):
+    get_budget_store().put(table_key(table), signature, {"daily": cube.daily})
+
+
+def load_budget_cube(table: str, values: List[List], hashes: Optional[np.ndarray] = None) -> BudgetCube:
+    # The cube persisted for the table is used as long as the table holds the rows it was saved with, any edit
+    # rebuilds it from them. It is signed with the raw values of the table, cheap to hash, or after an import, which
+    # does not read the table back, with the hashes of its rows until the next check signs it with the values again.
+    if len(values) < 2:
+        return BudgetCube.empty()
+    store, key, signature = get_budget_store(), table_key(table), table_signature(values)
+    cached = store.get(key, signature)
+    if cached is None:
+        cached = store.get(key, rows_signature(table_row_hashes(values) if hashes is None else hashes))
+        if cached is not None:
+            store.put(key, signature, cached)
+    if cached is not None:
+        return BudgetCube(cached["daily"])
+    cube = BudgetCube.from_transactions(preprocess_budget_data(table_values_to_frame(values)))
+    save_budget_cube(table, cube, signature)
+    return cube
+
+
+def update_budget(
+    writer: Optional[XlwingsWorkbookWriter] = None,
+    budget_history_df: Optional[pd.DataFrame] = None,
+    values: Optional[List[List]] = None,
+) -> BudgetCube:
+    # Called from the O2 dropdown without arguments, `main` passes its writer, the raw values of the table and the
+    # table preprocessed from them. Windows are summed from the budget cube, which the dropdown only regroups when
+    # the table changed.
+    owns_writer = writer is None
+    if owns_writer:
+        import xlwings as xw
+
+        writer = XlwingsWorkbookWriter(xw.Book.caller())
+    try:
+        budget_sheet = writer.sheet("Budget")
+        table = budget_sheet.xw_sheet.book.fullname
+        values = budget_sheet.read_table_values("B2") if values is None else values
+        if budget_history_df is None:
+            cube = load_budget_cube(table, values)
+        else:
+            cube = BudgetCube.from_transactions(budget_history_df)
+            save_budget_cube(table, cube, table_signature(values))
+
+        # Get value of dropdown menu on cell 'O2'
+        window = get_budget_window(budget_sheet.read_value("O2"))
+        # Set color to gay, text color as white
+        budget_sheet.set_format("O2", color=(192, 192, 192), font_color=-1)
+
+        render_budget_cube(cube, budget_sheet, window)
+        return cube
+    finally:
+        if owns_writer:
+            writer.close()
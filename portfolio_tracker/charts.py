@@ -0,0 +1,73 @@
+import hashlib
+import io
+import types
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Set, Tuple
+
+import pandas as pd
+
+from portfolio_tracker.constant import CHART_MAX_WORKERS, CHART_POOL_MIN_CHARTS
+
+# A chart is a top-level function building a matplotlib figure and its keyword arguments, so it can be rendered
+# in another process
+Chart = Tuple[Callable, Dict]
+
+
+def _hash_value(value) -> bytes:
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return repr((value.shape, getattr(value, "name", None), str(value.dtypes))).encode() + (
+            pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes()
+        )
+    return repr(value).encode()
+
+
+def _hash_code(code: types.CodeType, module_globals: Dict, digest, seen: Set):
+    # Bytecode and constants of a function, with the nested functions it defines and the functions of its own module
+    # it calls, so editing any of them changes the key. Code objects are hashed by content, their repr holds an
+    # address that differs between processes.
+    if code in seen:
+        return
+    seen.add(code)
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, module_globals, digest, seen)
+        else:
+            digest.update(repr(const).encode())
+    for name in code.co_names:
+        helper = module_globals.get(name)
+        if isinstance(helper, types.FunctionType) and helper.__module__ == module_globals.get("__name__"):
+            _hash_code(helper.__code__, module_globals, digest, seen)
+
+
+def chart_key(draw: Callable, kwargs: Dict) -> str:
+    # Content address of a chart: the drawing function, its code and every argument it is drawn from
+    digest = hashlib.sha256(f"{draw.__module__}.{draw.__qualname__}".encode())
+    _hash_code(draw.__code__, draw.__globals__, digest, set())
+    for name in sorted(kwargs):
+        digest.update(name.encode())
+        digest.update(_hash_value(kwargs[name]))
+    return digest.hexdigest()
+
+
+def render_chart(draw: Callable, kwargs: Dict) -> bytes:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    fig = draw(**kwargs)
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def render_charts(charts: List[Chart], max_workers: int = CHART_MAX_WORKERS) -> List[bytes]:
+    # PNG bytes of every chart, in order
+    if max_workers <= 1 or len(charts) < CHART_POOL_MIN_CHARTS:
+        return [render_chart(draw, kwargs) for draw, kwargs in charts]
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(charts))) as pool:
+        return list(pool.map(render_chart, *zip(*charts)))
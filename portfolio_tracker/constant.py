@@ -1,3 +1,5 @@
+import datetime as dt
+import os
 from enum import Enum
 
 
@@ -21,6 +23,11 @@ class Side(Enum):
     withdrawal = "Withdrawal"
 
 
+class CostBasisMethod(Enum):
+    average = "average"
+    fifo = "fifo"
+
+
 class MovementType(Enum):
     deposit = "Deposit"
     withdrawal = "Withdrawal"
@@ -71,6 +78,7 @@ class PortfolioColumns(Enum):
     value_local_currency = "Valorisation Local Ccy"
     value_book_currency = "Valorisation Reporting Ccy"
     delta = "Delta"
+    realized = "Realized P&L"
     dividends = "Dividends"
 
     returns = "Returns"
@@ -83,8 +91,13 @@ class PortfolioColumns(Enum):
 
 class YFinanceColumns(Enum):
     date = "Date"
+    open = "Open"
+    high = "High"
+    low = "Low"
     price = "Close"
+    volume = "Volume"
     dividends = "Dividends"
+    splits = "Stock Splits"
 
 
 class CashAccountSummary(Enum):
@@ -114,6 +127,42 @@ class PortfolioSummary(Enum):
     value_euro = "Valorisation Reporting Ccy"
 
 
+CACHE_DIR = os.environ.get(
+    "PORTFOLIO_TRACKER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "portfolio_tracker")
+)
+
+METADATA_TTL = dt.timedelta(hours=float(os.environ.get("PORTFOLIO_TRACKER_METADATA_TTL_HOURS", 24)))
+
+PREFETCH_CHUNK_SIZE = 50
+FETCH_MAX_WORKERS = 8
+FETCH_REQUESTS_PER_SECOND = 5.0
+
+# Charts are rendered in a process pool once a run has at least CHART_POOL_MIN_CHARTS of them, fewer are rendered
+# in-process as starting the workers would cost more than it saves
+CHART_MAX_WORKERS = min(4, os.cpu_count() or 1)
+CHART_POOL_MIN_CHARTS = 6
+CHART_CACHE_MAX_AGE = dt.timedelta(days=7)
+
+IMPORT_CHUNK_SIZE = 10_000
+
+# How sells are matched against earlier buys to compute the cost of the open position and the realized P&L
+COST_BASIS_METHOD = CostBasisMethod(os.environ.get("PORTFOLIO_TRACKER_COST_BASIS", CostBasisMethod.average.value))
+
+# Every run writes its timings and counters to RUN_REPORT_PATH, PROFILE_ENV_VAR may name a file to dump a cProfile of
+# the run to
+RUN_REPORT_PATH = os.path.join(CACHE_DIR, "last_run.json")
+PROFILE_ENV_VAR = "PORTFOLIO_TRACKER_PROFILE"
+
+BUDGET_HELP_TEXT = "To import a bank account history, either paste your history starting from B2 cell and specify headers in constant.py, or go to Developer > Insert > Button, and link the button to the import_csv() function in budget_utils.py "
+
+# strptime format of the dates of the Budget table and of imported CSVs, guessed from the first date when not set
+BUDGET_DATE_FORMAT = os.environ.get("PORTFOLIO_TRACKER_BUDGET_DATE_FORMAT")
+
+FX_BASE_CURRENCY = "USD"
+
+# Currencies some instruments are quoted in, as (main currency, subunits per unit)
+SUBUNIT_CURRENCIES = {"GBp": ("GBP", 100.0), "GBX": ("GBP", 100.0), "ZAc": ("ZAR", 100.0), "ILA": ("ILS", 100.0)}
+
 MARKET_MAP = {"XLON": "L", "XSTO": "ST", "XPAR": "PA"}
 
 SIDE_TO_IBUY = {Side.buy: 1, Side.sell: -1, Side.deposit: 1, Side.withdrawal: -1}
@@ -129,6 +178,7 @@ PORTFOLIO_DISPLAY_ORDER = [
     PortfolioColumns.value_local_currency.value,
     PortfolioColumns.value_book_currency.value,
     PortfolioColumns.delta.value,
+    PortfolioColumns.realized.value,
     PortfolioColumns.dividends.value,
     PortfolioColumns.gross_profits.value,
     PortfolioColumns.net_profits.value,
@@ -0,0 +1,72 @@
+from typing import Dict, Optional
+
+import pandas as pd
+
+from portfolio_tracker.constant import OrderColumns
+from portfolio_tracker.ledger import Ledger
+from portfolio_tracker.panel import PortfolioPanel
+from portfolio_tracker.portfolio_utils import consolidate_portfolio_returns
+from portfolio_tracker.timeline import Timelines
+
+
+# Run-scoped results shared by the tables and charts of a run, every return series and instrument timeline is
+# computed at most once and the charts and metrics read views of it
+class RunContext:
+    def __init__(self, orders: Ledger, book_currencies: Dict[str, str], reporting_currency: str = "EUR"):
+        self.orders = orders
+        self.book_currencies = book_currencies
+        self.reporting_currency = reporting_currency
+        self.timelines = Timelines(orders)
+        self._panels: Dict[str, PortfolioPanel] = {}
+        self._returns: Dict[Optional[str], pd.Series] = {}
+        self._values: Dict[str, pd.Series] = {}
+
+    @property
+    def portfolio_keys(self):
+        return self.orders.keys(OrderColumns.portfolio.value)
+
+    def book_currency(self, portfolio_key: str) -> str:
+        return self.book_currencies.get(portfolio_key, self.reporting_currency)
+
+    def portfolio_orders(self, portfolio_key: str) -> pd.DataFrame:
+        return self.orders.select(portfolio_key, OrderColumns.portfolio.value)
+
+    def inception_date(self, portfolio_key: Optional[str] = None) -> pd.Timestamp:
+        orders = self.orders.df if portfolio_key is None else self.portfolio_orders(portfolio_key)
+        return orders[OrderColumns.date.value].min()
+
+    def panel(self, portfolio_key: str) -> PortfolioPanel:
+        if portfolio_key not in self._panels:
+            self._panels[portfolio_key] = PortfolioPanel(
+                self.portfolio_orders(portfolio_key), self.book_currency(portfolio_key), timelines=self.timelines
+            )
+        return self._panels[portfolio_key]
+
+    def seed(self, portfolio_key: str, returns: pd.Series, value: pd.Series):
+        # Results of a portfolio restored from a previous run, its panel is then never evaluated
+        self._returns[portfolio_key] = returns
+        self._values[portfolio_key] = value
+
+    def portfolio_returns(self, portfolio_key: str) -> pd.Series:
+        if portfolio_key not in self._returns:
+            self._returns[portfolio_key] = self.panel(portfolio_key).returns
+        return self._returns[portfolio_key]
+
+    def portfolio_value(self, portfolio_key: str) -> pd.Series:
+        if portfolio_key not in self._values:
+            self._values[portfolio_key] = self.panel(portfolio_key).total_value
+        return self._values[portfolio_key]
+
+    def consolidated_returns(self) -> pd.Series:
+        # Stored under the None key, returns of all the books in the reporting currency
+        if None not in self._returns:
+            self._returns[None] = consolidate_portfolio_returns(
+                {key: self.portfolio_value(key) for key in self.portfolio_keys},
+                self.all_portfolio_returns(),
+                self.book_currencies,
+                self.reporting_currency,
+            )
+        return self._returns[None]
+
+    def all_portfolio_returns(self) -> Dict[str, pd.Series]:
+        return {key: self.portfolio_returns(key) for key in self.portfolio_keys}
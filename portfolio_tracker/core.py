@@ -1,10 +1,11 @@
 import datetime as dt
-from enum import Enum
-from typing import Dict, Type
+from typing import Dict, List, Optional
 
 import pandas as pd
 
 from portfolio_tracker.constant import (
+    COST_BASIS_METHOD,
+    CostBasisMethod,
     OrderColumns,
     MovementColumns,
     MovementType,
@@ -12,41 +13,39 @@ from portfolio_tracker.constant import (
     YFinanceColumns,
     CashAccountSummary,
     PortfolioSummary,
-    Side,
-    SIDE_TO_IBUY,
 )
+from portfolio_tracker.ledger import Ledger
+from portfolio_tracker.lots import account_lots
+from portfolio_tracker.timeline import Timelines
 from portfolio_tracker.portfolio_utils import (
     compute_sharpe_ratio,
-    compute_position_value_and_dividend_over_time,
     compute_portfolio_returns_over_time,
     compute_backtest_metrics,
 )
+from portfolio_tracker.fx import get_today_forex_rates
 from portfolio_tracker.utils import (
-    positive_weighted_average,
     get_historical_prices_with_dates,
     get_company_info,
-    get_today_forex_rates,
 )
 
 
-def compute_signed_quantity(df: pd.DataFrame, cols: Type[Enum]):
-    df[cols.side.value] = df[cols.side.value].apply(Side)
-    df[cols.side.value] = df[cols.side.value].apply(lambda s: SIDE_TO_IBUY[s])
-    df[cols.qty.value] *= df[cols.side.value]
-    return df
-
-
-def aggregate_orders_to_portfolio_df(order_data: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+def aggregate_orders_to_portfolio_df(
+    orders: Ledger,
+    portfolio_keys: Optional[List[str]] = None,
+    cost_basis_method: CostBasisMethod = COST_BASIS_METHOD,
+    timelines: Optional[Timelines] = None,
+) -> Dict[str, pd.DataFrame]:
     portfolios = {}
-    all_portfolio = order_data[OrderColumns.portfolio.value].unique()
-    for portfolio_key in all_portfolio:
-        sub_df = order_data[order_data[OrderColumns.portfolio.value] == portfolio_key].copy()
-        grouped_df = sub_df.groupby([OrderColumns.sym.value, OrderColumns.market.value])
+    if portfolio_keys is None:
+        portfolio_keys = orders.keys(OrderColumns.portfolio.value)
+    timelines = timelines or Timelines(orders)
+    timelines.build(portfolio_keys)
+    # Cost of the open positions and realized P&L of every instrument, from a single walk over the trades
+    positions, _ = account_lots(orders, cost_basis_method, portfolio_keys)
+    for portfolio_key in portfolio_keys:
+        sub_df = orders.select(portfolio_key, OrderColumns.portfolio.value)
+        grouped_df = sub_df.groupby([OrderColumns.sym.value, OrderColumns.market.value], observed=True)
 
-        avg_unit_cost = grouped_df.apply(
-            positive_weighted_average, OrderColumns.unit_cost.value, OrderColumns.qty.value
-        )
-        total_dividend_earned = grouped_df.apply(lambda g: compute_position_value_and_dividend_over_time(g)[1].sum())
         portfolio_df = grouped_df.agg(
             {
                 OrderColumns.date.value: "last",
@@ -55,14 +54,20 @@ def aggregate_orders_to_portfolio_df(order_data: pd.DataFrame) -> Dict[str, pd.D
                 OrderColumns.taxes.value: "sum",
             }
         )
-        portfolio_df[PortfolioColumns.unit_cost.value] = avg_unit_cost
-        portfolio_df[PortfolioColumns.dividends.value] = total_dividend_earned
+        lots = positions.loc[portfolio_key].reindex(portfolio_df.index.tolist())
+        portfolio_df[PortfolioColumns.unit_cost.value] = lots[PortfolioColumns.unit_cost.value].to_numpy()
+        portfolio_df[PortfolioColumns.realized.value] = lots[PortfolioColumns.realized.value].to_numpy()
+        portfolio_df[PortfolioColumns.dividends.value] = [
+            timelines.timeline(portfolio_key, sym, market).dividend_flows.sum() for sym, market in portfolio_df.index
+        ]
 
         portfolios[portfolio_key] = portfolio_df
     return portfolios
 
 
-def build_portfolio_analytics(portfolio_df: pd.DataFrame, book_currency: str) -> pd.DataFrame:
+def build_portfolio_analytics(
+    portfolio_df: pd.DataFrame, book_currency: str, timelines: Optional[Timelines] = None
+) -> pd.DataFrame:
     portfolio_df[
         [
             PortfolioColumns.value_local_currency.value,
@@ -81,21 +86,17 @@ def build_portfolio_analytics(portfolio_df: pd.DataFrame, book_currency: str) ->
     for sym, market in portfolio_df.index:
         idx = (sym, market)
         date = portfolio_df.loc[idx, PortfolioColumns.date.value].date()
-        historical_data = get_historical_prices_with_dates(sym, market, date, today)
+        if timelines is not None:
+            historical_data = timelines.history(sym, market, date)
+        else:
+            historical_data = get_historical_prices_with_dates(sym, market, date, today)
         instrument_name, local_ccy = get_company_info(sym, market)
 
         today_price_local_ccy = historical_data[YFinanceColumns.price.value].iloc[-1]
 
         fx_rate = 1
         if local_ccy != book_currency:
-            if local_ccy == "GBp" and book_currency == "GBP":
-                # fx_rate = 1 / 100
-                today_price_local_ccy /= 100
-                portfolio_df.loc[idx, PortfolioColumns.dividends.value] /= 100
-            elif local_ccy == "GBp":
-                fx_rate = get_today_forex_rates("GBP", book_currency) / 100
-            else:
-                fx_rate = get_today_forex_rates(local_ccy, book_currency)
+            fx_rate = get_today_forex_rates(local_ccy, book_currency)
         historical_data[[YFinanceColumns.price.value, YFinanceColumns.dividends.value]] *= fx_rate
 
         # Adding the metrics to the DataFrame
@@ -116,7 +117,9 @@ def build_portfolio_analytics(portfolio_df: pd.DataFrame, book_currency: str) ->
         - portfolio_df[PortfolioColumns.unit_cost.value] * portfolio_df[PortfolioColumns.qty.value]
     )
     portfolio_df[PortfolioColumns.gross_profits.value] = (
-        portfolio_df[PortfolioColumns.delta.value] + portfolio_df[PortfolioColumns.dividends.value]
+        portfolio_df[PortfolioColumns.delta.value]
+        + portfolio_df[PortfolioColumns.realized.value]
+        + portfolio_df[PortfolioColumns.dividends.value]
     )
     portfolio_df[PortfolioColumns.net_profits.value] = (
         portfolio_df[PortfolioColumns.gross_profits.value]
@@ -135,22 +138,18 @@ def build_portfolio_analytics(portfolio_df: pd.DataFrame, book_currency: str) ->
 
 
 def build_cash_accounts_summary(
-    mvt_df: pd.DataFrame,
-    order_df: pd.DataFrame,
+    movements: Ledger,
+    orders: Ledger,
     portfolios: Dict[str, pd.DataFrame],
     book_currencies: Dict[str, str],
     master_currency="EUR",
 ):
-    cash_account_names = mvt_df[MovementColumns.account.value].unique().tolist()
     cash_accounts = []
 
-    for key in cash_account_names:
-        assert (
-            mvt_df.loc[mvt_df[MovementColumns.account.value] == key, MovementColumns.currency.value]
-        ).nunique() == 1, "Cash Accounts only support one currency."
-        local_currency = mvt_df.loc[mvt_df[MovementColumns.account.value] == key, MovementColumns.currency.value].iloc[
-            0
-        ]
+    for key in movements.keys(MovementColumns.account.value):
+        account_df = movements.select(key, MovementColumns.account.value)
+        assert account_df[MovementColumns.currency.value].nunique() == 1, "Cash Accounts only support one currency."
+        local_currency = account_df[MovementColumns.currency.value].iloc[0]
         assert (
             key in portfolios and book_currencies.get(key, master_currency) == local_currency
         ) or key not in portfolios, "Cash account currency must be the same as book currency."
@@ -159,23 +158,12 @@ def build_cash_accounts_summary(
         if local_currency != master_currency:
             fx_rate = get_today_forex_rates(local_currency, master_currency)
 
-        open_date = mvt_df.loc[mvt_df[MovementColumns.account.value] == key, MovementColumns.date.value].min()
-        balance = mvt_df.loc[mvt_df[MovementColumns.account.value] == key, MovementColumns.qty.value].sum()
-        interest = mvt_df.loc[
-            (mvt_df[MovementColumns.account.value] == key)
-            & (mvt_df[MovementColumns.type.value] == MovementType.interest.value),
-            MovementColumns.qty.value,
-        ].sum()
-        fees = mvt_df.loc[
-            (mvt_df[MovementColumns.account.value] == key)
-            & (mvt_df[MovementColumns.type.value] == MovementType.fees.value),
-            MovementColumns.qty.value,
-        ].sum()
-        taxes = mvt_df.loc[
-            (mvt_df[MovementColumns.account.value] == key)
-            & (mvt_df[MovementColumns.type.value] == MovementType.taxes.value),
-            MovementColumns.qty.value,
-        ].sum()
+        movement_types = account_df[MovementColumns.type.value]
+        open_date = account_df[MovementColumns.date.value].min()
+        balance = account_df[MovementColumns.qty.value].sum()
+        interest = account_df.loc[movement_types == MovementType.interest.value, MovementColumns.qty.value].sum()
+        fees = account_df.loc[movement_types == MovementType.fees.value, MovementColumns.qty.value].sum()
+        taxes = account_df.loc[movement_types == MovementType.taxes.value, MovementColumns.qty.value].sum()
 
         row = {
             CashAccountSummary.open_date.value: open_date,
@@ -187,7 +175,7 @@ def build_cash_accounts_summary(
         }
 
         if key in portfolios:
-            sub_df = order_df.loc[order_df[OrderColumns.portfolio.value] == key]
+            sub_df = orders.select(key, OrderColumns.portfolio.value)
             delta = -(sub_df[OrderColumns.book_cost.value] * sub_df[OrderColumns.side.value]).sum()
             delta -= sub_df[OrderColumns.fees.value].sum()
             delta -= sub_df[OrderColumns.taxes.value].sum()
@@ -203,14 +191,16 @@ def build_cash_accounts_summary(
 
 
 def build_portfolio_summary(
-    order_df: pd.DataFrame,
+    orders: Ledger,
     portfolios: Dict[str, pd.DataFrame],
     book_currencies: Dict[str, str],
     master_currency="EUR",
+    portfolio_returns: Optional[Dict[str, pd.Series]] = None,
 ):
     portfolio_summary_records = []
     for key, portfolio_df in portfolios.items():
-        open_date = order_df.loc[order_df[OrderColumns.portfolio.value] == key, OrderColumns.date.value].min()
+        portfolio_orders = orders.select(key, OrderColumns.portfolio.value)
+        open_date = portfolio_orders[OrderColumns.date.value].min()
         book_currency = book_currencies.get(key, master_currency)
 
         deposits = (portfolio_df[PortfolioColumns.unit_cost.value] * portfolio_df[PortfolioColumns.qty.value]).sum()
@@ -218,9 +208,10 @@ def build_portfolio_summary(
         fees = portfolio_df[PortfolioColumns.fees.value].sum()
         deposits += taxes + fees
 
-        returns_ts = compute_portfolio_returns_over_time(
-            order_df.loc[order_df[OrderColumns.portfolio.value] == key, :], book_currency
-        )
+        if portfolio_returns is not None and key in portfolio_returns:
+            returns_ts = portfolio_returns[key]
+        else:
+            returns_ts = compute_portfolio_returns_over_time(portfolio_orders, book_currency)
         sharpe, vol, max_dd = compute_backtest_metrics(returns_ts)
 
         value_book_currency = portfolio_df[PortfolioColumns.value_book_currency.value].sum()
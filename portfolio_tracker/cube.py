@@ -0,0 +1,80 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.constant import BudgettingColumns
+
+INCOME = "income"
+EXPENSES = "expenses"
+# Transactions with this receiver are counted in the totals but left out of the category pies
+EXCLUDED_RECEIVER = "antoine toffano"
+
+CUBE_LEVELS = ["kind", BudgettingColumns.category.value, BudgettingColumns.subcategory.value, "excluded"]
+
+
+# Daily amounts of preprocessed budget transactions, one column per (income/expenses, category, subcategory,
+# excluded receiver) cell. Any window is answered by summing the rows of its date range.
+class BudgetCube:
+    def __init__(self, daily: pd.DataFrame):
+        self.daily = daily
+
+    @classmethod
+    def empty(cls) -> "BudgetCube":
+        return cls(
+            pd.DataFrame(
+                index=pd.DatetimeIndex([], name=BudgettingColumns.date.value),
+                columns=pd.MultiIndex.from_tuples([], names=CUBE_LEVELS),
+                dtype=float,
+            )
+        )
+
+    @staticmethod
+    def aggregate(budget_history_df: pd.DataFrame) -> pd.DataFrame:
+        amount = budget_history_df[BudgettingColumns.amount.value]
+        df = budget_history_df[amount != 0]
+        if df.empty:
+            return BudgetCube.empty().daily
+        amount = df[BudgettingColumns.amount.value]
+        keys = [
+            pd.to_datetime(df[BudgettingColumns.date.value]).dt.normalize().rename(BudgettingColumns.date.value),
+            pd.Series(np.where(amount > 0, INCOME, EXPENSES), index=df.index, name="kind"),
+            df[BudgettingColumns.category.value],
+            df[BudgettingColumns.subcategory.value],
+            df[BudgettingColumns.receiver.value].astype(str).str.contains(EXCLUDED_RECEIVER).rename("excluded"),
+        ]
+        daily = amount.abs().groupby(keys, observed=True).sum().unstack(CUBE_LEVELS, fill_value=0.0)
+        # Plain labels rather than the categories of the input, so cubes built from different frames line up
+        daily.columns = pd.MultiIndex.from_tuples(daily.columns.tolist(), names=CUBE_LEVELS)
+        return daily.sort_index()
+
+    @classmethod
+    def from_transactions(cls, budget_history_df: pd.DataFrame) -> "BudgetCube":
+        return cls(cls.aggregate(budget_history_df))
+
+    def add(self, budget_history_df: pd.DataFrame):
+        # Folds newly imported transactions in, without going back to the rest of the history
+        self.daily = self.daily.add(self.aggregate(budget_history_df), fill_value=0.0).fillna(0.0).sort_index()
+
+    def window_sums(self, window: Optional[Tuple] = None) -> pd.Series:
+        # Same bounds as get_income/get_expenses: strictly after the start and strictly before the end
+        values = self.daily.to_numpy()
+        if window:
+            dates = self.daily.index
+            start = dates.searchsorted(pd.to_datetime(window[0]), side="right")
+            end = dates.searchsorted(pd.to_datetime(window[1]), side="left")
+            values = values[start:end]
+        return pd.Series(values.sum(axis=0), index=self.daily.columns, dtype=float)
+
+    def totals(self, window: Optional[Tuple] = None) -> Tuple[float, float]:
+        # Income as a positive and expenses as a negative amount
+        sums = self.window_sums(window)
+        kinds = sums.index.get_level_values("kind")
+        return sums[kinds == INCOME].sum(), -sums[kinds == EXPENSES].sum()
+
+    def by_category(self, kind: str, window: Optional[Tuple] = None, subcategory: bool = False) -> pd.Series:
+        sums = self.window_sums(window)
+        sums = sums[(sums.index.get_level_values("kind") == kind) & ~sums.index.get_level_values("excluded")]
+        level = BudgettingColumns.subcategory.value if subcategory else BudgettingColumns.category.value
+        grouped = sums.groupby(level=level).sum()
+        return grouped[grouped != 0].rename(BudgettingColumns.amount.value)
@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+from portfolio_tracker.constant import FETCH_MAX_WORKERS, FETCH_REQUESTS_PER_SECOND
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second: Optional[float]):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Hand out evenly spaced slots, callers sleep outside of the lock until theirs
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+class Fetcher:
+    def __init__(
+        self, max_workers: int = FETCH_MAX_WORKERS, requests_per_second: Optional[float] = FETCH_REQUESTS_PER_SECOND
+    ):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetcher")
+        self._rate_limiter = RateLimiter(requests_per_second)
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _run(self, fn: Callable, *args):
+        self._rate_limiter.acquire()
+        return fn(*args)
+
+    def _release(self, key: Hashable, future: Future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def submit(self, key: Hashable, fn: Callable, *args) -> Future:
+        # Requests for a key already in flight share the pending future instead of hitting the network again
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key]
+            future = self._executor.submit(self._run, fn, *args)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._release(key, f))
+        return future
+
+    def fetch(self, key: Hashable, fn: Callable, *args):
+        return self.submit(key, fn, *args).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_fetcher: Fetcher = None
+
+
+def get_fetcher() -> Fetcher:
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher()
+    return _fetcher
+
+
+def configure_fetcher(
+    max_workers: int = FETCH_MAX_WORKERS, requests_per_second: Optional[float] = FETCH_REQUESTS_PER_SECOND
+) -> Fetcher:
+    global _fetcher
+    if _fetcher is not None:
+        _fetcher.shutdown()
+    _fetcher = Fetcher(max_workers, requests_per_second)
+    return _fetcher
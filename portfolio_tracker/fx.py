@@ -0,0 +1,94 @@
+import datetime as dt
+import threading
+from typing import Dict, Iterable, Tuple
+
+import pandas as pd
+
+from portfolio_tracker.constant import FX_BASE_CURRENCY, SUBUNIT_CURRENCIES, YFinanceColumns
+from portfolio_tracker.utils import get_fx_history
+
+
+def get_quoted_currency(currency: str) -> Tuple[str, float]:
+    # Instruments quoted in a subunit (e.g. GBp) are priced from their main currency
+    return SUBUNIT_CURRENCIES.get(currency, (currency, 1.0))
+
+
+class FxMatrix:
+    # Dates x currencies matrix holding the amount of each currency worth one unit of FX_BASE_CURRENCY,
+    # any cross rate is derived by dividing two of its columns
+    def __init__(self, base_currency: str = FX_BASE_CURRENCY):
+        self.base_currency = base_currency
+        self._series: Dict[str, pd.Series] = {}
+        self._starts: Dict[str, pd.Timestamp] = {}
+        self._ends: Dict[str, pd.Timestamp] = {}
+        self._matrix = None
+        self._lock = threading.RLock()
+
+    def ensure(self, currencies: Iterable[str], start_date, end_date=None):
+        # A currency is loaded again when a range starting earlier or ending later than the loaded one is asked for,
+        # so a matrix kept across days tops up to the new day like the prices do
+        start = pd.Timestamp(start_date).normalize()
+        end = pd.Timestamp(end_date or dt.date.today()).normalize()
+        with self._lock:
+            for currency in {get_quoted_currency(c)[0] for c in currencies} - {self.base_currency}:
+                if currency in self._starts and self._starts[currency] <= start and self._ends[currency] >= end:
+                    continue
+                load_start = min(start, self._starts.get(currency, start))
+                load_end = max(end, self._ends.get(currency, end))
+                history = get_fx_history(self.base_currency, currency, load_start, load_end)
+                self._series[currency] = history[YFinanceColumns.price.value].rename(currency)
+                self._starts[currency], self._ends[currency] = load_start, load_end
+                self._matrix = None
+
+    @property
+    def matrix(self) -> pd.DataFrame:
+        with self._lock:
+            if self._matrix is None:
+                matrix = pd.concat(list(self._series.values()), axis=1) if self._series else pd.DataFrame()
+                matrix = matrix.sort_index().ffill()
+                matrix[self.base_currency] = 1.0
+                for subunit, (currency, factor) in SUBUNIT_CURRENCIES.items():
+                    if currency in matrix.columns:
+                        matrix[subunit] = matrix[currency] * factor
+                self._matrix = matrix
+            return self._matrix
+
+    def rates(self, base_currencies: Iterable[str], target_currency: str, start_date, end_date) -> pd.DataFrame:
+        # Conversion rates from each base currency into target_currency, one column per base currency
+        base_currencies = list(dict.fromkeys(base_currencies))
+        self.ensure(base_currencies + [target_currency], start_date, end_date)
+        matrix = self.matrix
+        matrix = matrix[(matrix.index >= pd.Timestamp(start_date)) & (matrix.index < pd.Timestamp(end_date))]
+        return matrix[base_currencies].rdiv(matrix[target_currency], axis=0)
+
+    def series(self, base_currency: str, target_currency: str, start_date, end_date) -> pd.Series:
+        return self.rates([base_currency], target_currency, start_date, end_date)[base_currency]
+
+    def spot(self, base_currency: str, target_currency: str) -> float:
+        today = dt.date.today()
+        return self.series(base_currency, target_currency, today - dt.timedelta(days=5), today).iloc[-1]
+
+
+_fx_matrix = None
+
+
+def get_fx_matrix() -> FxMatrix:
+    global _fx_matrix
+    if _fx_matrix is None:
+        _fx_matrix = FxMatrix()
+    return _fx_matrix
+
+
+def set_fx_matrix(fx_matrix: FxMatrix):
+    global _fx_matrix
+    _fx_matrix = fx_matrix
+
+
+def get_today_forex_rates(base_currency: str, target_currency: str) -> float:
+    return get_fx_matrix().spot(base_currency, target_currency)
+
+
+def get_forex_rates_series(
+    base_currency: str, target_currency: str, start_date: dt.date, end_date: dt.date
+) -> pd.Series:
+    return get_fx_matrix().series(base_currency, target_currency, start_date, end_date)
@@ -0,0 +1,201 @@
+import argparse
+import os
+from typing import Dict, Optional
+
+import pandas as pd
+
+from portfolio_tracker.constant import (
+    CostBasisMethod,
+    MovementColumns,
+    OrderColumns,
+    FETCH_MAX_WORKERS,
+    FETCH_REQUESTS_PER_SECOND,
+    RUN_REPORT_PATH,
+    COST_BASIS_METHOD,
+)
+from portfolio_tracker.budget_utils import load_budget_file
+from portfolio_tracker.fetcher import configure_fetcher
+from portfolio_tracker.fx import FxMatrix, set_fx_matrix
+from portfolio_tracker.instrumentation import Instrumentation, get_instrumentation, profiled, set_instrumentation
+from portfolio_tracker.run import run_budget, run_portfolios, write_run_report
+from portfolio_tracker.writers import FileWorkbookWriter, OpenpyxlWorkbookWriter, WorkbookWriter
+
+
+def read_workbook_table(path: str, sheet_name: str, origin: str = "B2") -> pd.DataFrame:
+    # The header row from `origin` to the first empty cell on the right, then every row down to the first one
+    # without a value in the origin column
+    from openpyxl import load_workbook
+    from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    ws = wb[sheet_name]
+    column, row = coordinate_from_string(origin)
+    column = column_index_from_string(column)
+
+    rows = ws.iter_rows(min_row=row, min_col=column, values_only=True)
+    header = next(rows, ())
+    width = next((i for i, value in enumerate(header) if value is None), len(header))
+    records = []
+    for values in rows:
+        values = values[:width]
+        if not values or values[0] is None:
+            break
+        records.append(values)
+    wb.close()
+    return pd.DataFrame.from_records(records, columns=list(header[:width]))
+
+
+def read_export(path: str, date_column: Optional[str] = None) -> pd.DataFrame:
+    # Only the given date column is parsed, the dates of a budget export are left to BudgetDateParser
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    if date_column is not None and date_column in df.columns:
+        df[date_column] = pd.to_datetime(df[date_column])
+    return df
+
+
+def run_headless(
+    book_currencies: Dict[str, str],
+    writer: WorkbookWriter,
+    reporting_currency: str = "EUR",
+    workbook_path: Optional[str] = None,
+    orders_path: Optional[str] = None,
+    movements_path: Optional[str] = None,
+    budget_path: Optional[str] = None,
+    sheet_names: Optional[Dict[str, str]] = None,
+    incremental: bool = False,
+    max_workers: int = FETCH_MAX_WORKERS,
+    requests_per_second: float = FETCH_REQUESTS_PER_SECOND,
+    report_path: Optional[str] = RUN_REPORT_PATH,
+    diagnostics: bool = False,
+    profile_path: Optional[str] = None,
+    cost_basis_method: CostBasisMethod = COST_BASIS_METHOD,
+):
+    sheet_names = {
+        "Orders": "Orders",
+        "Movements": "Movements",
+        "Budget": "Budget",
+        "Summary": "Summary",
+        **(sheet_names or {}),
+    }
+    set_instrumentation(Instrumentation())
+    # FX histories loaded by a previous run of the session end on the day it ran
+    set_fx_matrix(FxMatrix())
+    instrumentation = get_instrumentation()
+    configure_fetcher(max_workers, requests_per_second)
+
+    with profiled(profile_path):
+        with instrumentation.stage("run.read_inputs"):
+            if orders_path is not None:
+                order_data = read_export(orders_path, OrderColumns.date.value)
+                mvt_data = read_export(movements_path, MovementColumns.date.value)
+                budget_history_df = (
+                    load_budget_file(budget_path, lambda: read_export(budget_path)) if budget_path else pd.DataFrame()
+                )
+            else:
+                order_data = read_workbook_table(workbook_path, sheet_names["Orders"])
+                mvt_data = read_workbook_table(workbook_path, sheet_names["Movements"])
+                budget_history_df = load_budget_file(
+                    workbook_path,
+                    lambda: read_workbook_table(workbook_path, sheet_names["Budget"]),
+                    sheet_names["Budget"],
+                )
+
+            order_data[OrderColumns.date.value] = pd.to_datetime(order_data[OrderColumns.date.value])
+            mvt_data[MovementColumns.date.value] = pd.to_datetime(mvt_data[MovementColumns.date.value])
+
+        run_portfolios(
+            order_data,
+            mvt_data,
+            book_currencies,
+            reporting_currency,
+            writer,
+            incremental,
+            cost_basis_method,
+            sheet_names["Summary"],
+        )
+        run_budget(budget_history_df, writer.sheet(sheet_names["Budget"]))
+
+        # Timings up to the final flush of the workbook, the JSON report covers the whole run
+        if diagnostics:
+            writer.sheet("Diagnostics", create=True).write_table(instrumentation.to_frame(), "B2", index=False)
+        writer.close()
+
+    write_run_report(writer, report_path)
+    print(
+        f"Done, {writer.charts_from_cache} of {writer.charts_rendered + writer.charts_from_cache} charts served from cache"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the portfolio tracker without Excel.")
+    parser.add_argument("--workbook", help="Workbook to read the Orders, Movements and Budget tables from.")
+    parser.add_argument("--orders", help="CSV or Parquet export of the Orders table.")
+    parser.add_argument("--movements", help="CSV or Parquet export of the Movements table.")
+    parser.add_argument("--budget", help="CSV or Parquet export of the Budget table.")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="Directory to write the tables and charts to, or an .xlsx/.xlsm path to write a copy of the workbook.",
+    )
+    parser.add_argument(
+        "--book", action="append", default=[], metavar="PORTFOLIO=CCY", help="Currency of a book, e.g. US_BOOK=USD."
+    )
+    parser.add_argument("--orders-sheet", default="Orders")
+    parser.add_argument("--movements-sheet", default="Movements")
+    parser.add_argument("--budget-sheet", default="Budget")
+    parser.add_argument("--summary-sheet", default="Summary")
+    parser.add_argument("--reporting-currency", default="EUR")
+    parser.add_argument(
+        "--incremental", action="store_true", help="Only recompute the portfolios whose orders or market data changed."
+    )
+    parser.add_argument(
+        "--cost-basis",
+        choices=[method.value for method in CostBasisMethod],
+        default=COST_BASIS_METHOD.value,
+        help="How sells are matched against earlier buys.",
+    )
+    parser.add_argument("--max-workers", type=int, default=FETCH_MAX_WORKERS)
+    parser.add_argument("--requests-per-second", type=float, default=FETCH_REQUESTS_PER_SECOND)
+    parser.add_argument("--report", default=RUN_REPORT_PATH, help="Path of the JSON timing and I/O report.")
+    parser.add_argument(
+        "--diagnostics", action="store_true", help="Also write the timing and I/O report to a Diagnostics sheet."
+    )
+    parser.add_argument("--profile", help="Profile the run with cProfile and dump the stats to this path.")
+    args = parser.parse_args()
+    if args.workbook is None and (args.orders is None or args.movements is None):
+        parser.error("either --workbook or both --orders and --movements are required")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if os.path.splitext(args.output)[1] in (".xlsx", ".xlsm"):
+        writer = OpenpyxlWorkbookWriter(args.output, template_path=args.workbook)
+    else:
+        writer = FileWorkbookWriter(args.output)
+
+    run_headless(
+        book_currencies=dict(book.split("=", 1) for book in args.book),
+        writer=writer,
+        reporting_currency=args.reporting_currency,
+        workbook_path=args.workbook,
+        orders_path=args.orders,
+        movements_path=args.movements,
+        budget_path=args.budget,
+        sheet_names={
+            "Orders": args.orders_sheet,
+            "Movements": args.movements_sheet,
+            "Budget": args.budget_sheet,
+            "Summary": args.summary_sheet,
+        },
+        incremental=args.incremental,
+        max_workers=args.max_workers,
+        requests_per_second=args.requests_per_second,
+        report_path=args.report,
+        diagnostics=args.diagnostics,
+        profile_path=args.profile,
+        cost_basis_method=CostBasisMethod(args.cost_basis),
+    )
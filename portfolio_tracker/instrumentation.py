@@ -0,0 +1,111 @@
+import contextlib
+import cProfile
+import datetime as dt
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from typing import Dict, Optional
+
+import pandas as pd
+
+from portfolio_tracker.constant import PROFILE_ENV_VAR
+
+
+# Wall time per stage and counters (network calls and bytes, cache hits and misses, Excel round trips) of one run.
+# Stages may run concurrently on the fetcher's threads, their time is then the sum over the calls.
+class Instrumentation:
+    def __init__(self):
+        self.started_at = dt.datetime.now()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                entry["seconds"] += elapsed
+                entry["calls"] += 1
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = value
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "wall_seconds": time.perf_counter() - self._start,
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def to_frame(self) -> pd.DataFrame:
+        report = self.report()
+        rows = [("run", "wall_seconds", report["wall_seconds"], 1)]
+        rows += [("stage", name, entry["seconds"], entry["calls"]) for name, entry in report["stages"].items()]
+        rows += [("counter", name, value, None) for name, value in report["counters"].items()]
+        return pd.DataFrame(rows, columns=["Kind", "Name", "Value", "Calls"])
+
+    def write_json(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation):
+    global _instrumentation
+    _instrumentation = instrumentation
+
+
+def timed(name: str):
+    # Decorator recording every call of a function as a stage of the current run
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_instrumentation().stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[str]):
+    # cProfile of the enclosed block dumped to `path` with the top functions by cumulative time printed, when
+    # `path` is None the block runs unprofiled unless the PORTFOLIO_TRACKER_PROFILE variable names a file
+    path = path or os.environ.get(PROFILE_ENV_VAR)
+    if not path:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
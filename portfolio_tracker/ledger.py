@@ -0,0 +1,97 @@
+from enum import Enum
+from typing import Dict, List, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.constant import SIDE_TO_IBUY, MovementColumns, OrderColumns, Side
+
+SIDE_SIGNS = {side.value: sign for side, sign in SIDE_TO_IBUY.items()}
+
+# Columns stored as categoricals, whichever of them the ledger has
+KEY_COLUMNS = [
+    OrderColumns.portfolio.value,
+    OrderColumns.sym.value,
+    OrderColumns.market.value,
+    MovementColumns.account.value,
+    MovementColumns.type.value,
+    MovementColumns.currency.value,
+]
+AMOUNT_COLUMNS = [
+    OrderColumns.qty.value,
+    OrderColumns.unit_cost.value,
+    OrderColumns.book_cost.value,
+    OrderColumns.fees.value,
+    OrderColumns.taxes.value,
+    OrderColumns.total_cost.value,
+    MovementColumns.qty.value,
+]
+
+
+def signed_sides(sides: pd.Series) -> pd.Series:
+    # +1 for buys and deposits, -1 for sells and withdrawals
+    signs = sides.map(SIDE_SIGNS)
+    if signs.isna().any():
+        raise ValueError(f"{sides[signs.isna()].iloc[0]!r} is not a valid {Side.__name__}")
+    return signs.astype(np.int8)
+
+
+# Orders or movements sorted by date, with categorical keys, an int8 side and float64 amounts, the quantity signed
+# by the side. The rows of a portfolio, instrument or account are taken by position from offsets computed once per
+# key column, rather than by comparing strings over the whole frame.
+class Ledger:
+    def __init__(self, df: pd.DataFrame, cols: Type[Enum]):
+        self.cols = cols
+        df = df.copy()
+        df[cols.date.value] = pd.to_datetime(df[cols.date.value])
+        for column in KEY_COLUMNS:
+            if column in df.columns:
+                # Categories in order of first appearance, which is the order the keys are reported in
+                df[column] = pd.Categorical(df[column], categories=df[column].dropna().unique())
+        for column in AMOUNT_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype(np.float64)
+        df[cols.side.value] = signed_sides(df[cols.side.value])
+        df[cols.qty.value] *= df[cols.side.value]
+        self.df = df.sort_values(cols.date.value, kind="stable", ignore_index=True)
+        self._groups: Dict[Tuple[str, ...], Tuple[pd.Index, np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def _group(self, columns: Tuple[str, ...]) -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+        # The rows of the i-th key are at positions order[offsets[i]:offsets[i + 1]], in date order. Rows with a
+        # missing key belong to no group.
+        if columns not in self._groups:
+            if len(columns) == 1:
+                keys = self.df[columns[0]].cat.categories
+                codes = self.df[columns[0]].cat.codes.to_numpy().astype(np.int64)
+            else:
+                codes, keys = pd.MultiIndex.from_frame(self.df[list(columns)]).factorize()
+                codes = np.where(self.df[list(columns)].isna().any(axis=1), -1, codes)
+            order = np.argsort(codes, kind="stable")
+            order = order[codes[order] >= 0]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(keys)))])
+            self._groups[columns] = (pd.Index(keys), order, offsets)
+        return self._groups[columns]
+
+    def keys(self, *columns: str) -> List:
+        keys, _, offsets = self._group(columns)
+        return [key for key, count in zip(keys, np.diff(offsets)) if count]
+
+    def rows(self, key, *columns: str) -> np.ndarray:
+        keys, order, offsets = self._group(columns)
+        i = keys.get_loc(key) if key in keys else None
+        if i is None:
+            return order[:0]
+        return order[offsets[i] : offsets[i + 1]]
+
+    def select(self, key, *columns: str) -> pd.DataFrame:
+        return self.df.iloc[self.rows(key, *columns)]
+
+    def groups(self, *columns: str):
+        # (key, rows) of every key in order, without the per-key lookup of `rows`
+        keys, order, offsets = self._group(columns)
+        for i, key in enumerate(keys):
+            if offsets[i + 1] > offsets[i]:
+                yield key, order[offsets[i] : offsets[i + 1]]
@@ -0,0 +1,84 @@
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.constant import COST_BASIS_METHOD, CostBasisMethod, OrderColumns, PortfolioColumns
+from portfolio_tracker.ledger import Ledger
+
+# Quantities closer to zero than this are a closed position
+QTY_EPSILON = 1e-9
+
+INSTRUMENT_KEYS = [OrderColumns.portfolio.value, OrderColumns.sym.value, OrderColumns.market.value]
+POSITION_COLUMNS = [
+    PortfolioColumns.qty.value,
+    PortfolioColumns.unit_cost.value,
+    PortfolioColumns.realized.value,
+    OrderColumns.position_open_date.value,
+]
+LOT_COLUMNS = INSTRUMENT_KEYS + [OrderColumns.date.value, OrderColumns.qty.value, OrderColumns.unit_cost.value]
+
+
+def walk_trades(quantities: List[float], prices: List[float], dates: List, method: CostBasisMethod) -> Tuple:
+    # One pass over the signed trades of an instrument in date order. Trades against the open position close its
+    # lots first in first out, what is left opens a new lot. With average cost the open position is a single lot
+    # whose price is the weighted average of the trades that built it.
+    lots = deque()
+    realized = 0.0
+    opened_at, opening_qty, opening_cost = None, 0.0, 0.0
+    for qty, price, date in zip(quantities, prices, dates):
+        while lots and abs(qty) > QTY_EPSILON and (lots[0][1] > 0) != (qty > 0):
+            lot = lots[0]
+            closed = lot[1] if abs(lot[1]) <= abs(qty) else -qty
+            realized += closed * (price - lot[2])
+            lot[1] -= closed
+            qty += closed
+            if abs(lot[1]) <= QTY_EPSILON:
+                lots.popleft()
+        if abs(qty) <= QTY_EPSILON:
+            continue
+
+        if not lots:
+            opened_at, opening_qty, opening_cost = date, 0.0, 0.0
+        opening_qty += abs(qty)
+        opening_cost += abs(qty) * price
+        if method is CostBasisMethod.average and lots:
+            lot = lots[0]
+            lot[2] = (lot[1] * lot[2] + qty * price) / (lot[1] + qty)
+            lot[1] += qty
+        else:
+            lots.append([date, qty, price])
+
+    position = sum(lot[1] for lot in lots)
+    cost = sum(lot[1] * lot[2] for lot in lots)
+    # A closed position keeps the average price it was opened at
+    unit_cost = cost / position if lots else (opening_cost / opening_qty if opening_qty else np.nan)
+    return position, unit_cost, realized, opened_at, list(lots)
+
+
+def account_lots(
+    orders: Ledger, method: CostBasisMethod = COST_BASIS_METHOD, portfolio_keys: Optional[List[str]] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # Open position, its unit cost, the realized P&L and the open date of every (portfolio, symbol, market), and the
+    # lots the open positions are made of. Each instrument's trades are taken from the ledger in date order.
+    quantities = orders.df[OrderColumns.qty.value].to_numpy()
+    prices = orders.df[OrderColumns.unit_cost.value].to_numpy()
+    dates = orders.df[OrderColumns.date.value].to_numpy()
+
+    keys, positions, lots = [], [], []
+    for key, rows in orders.groups(*INSTRUMENT_KEYS):
+        if portfolio_keys is not None and key[0] not in portfolio_keys:
+            continue
+        position, unit_cost, realized, opened_at, open_lots = walk_trades(
+            quantities[rows].tolist(), prices[rows].tolist(), dates[rows], method
+        )
+        keys.append(key)
+        positions.append((position, unit_cost, realized, opened_at))
+        lots += [(*key, date, qty, price) for date, qty, price in open_lots]
+
+    index = pd.MultiIndex.from_tuples(keys, names=INSTRUMENT_KEYS)
+    return (
+        pd.DataFrame(positions, index=index, columns=POSITION_COLUMNS),
+        pd.DataFrame(lots, columns=LOT_COLUMNS),
+    )
@@ -0,0 +1,129 @@
+import datetime as dt
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.constant import OrderColumns, YFinanceColumns
+from portfolio_tracker.fx import get_fx_matrix
+from portfolio_tracker.timeline import Timelines
+from portfolio_tracker.trading_calendar import TradingCalendar
+from portfolio_tracker.utils import get_company_infos, get_historical_prices_with_dates, get_yfinance_sym
+
+
+# Dense dates x instruments view of a set of orders, every metric is a whole-array operation on the price and
+# position matrices. Instruments are identified by their yfinance symbol, amounts are in book currency.
+class PortfolioPanel:
+    def __init__(
+        self,
+        portfolio_order_df: pd.DataFrame,
+        book_currency: str,
+        end_date: Optional[dt.date] = None,
+        timelines: Optional[Timelines] = None,
+    ):
+        self.book_currency = book_currency
+        end_date = timelines.end_date if timelines is not None else end_date or dt.date.today()
+
+        instruments = portfolio_order_df[[OrderColumns.sym.value, OrderColumns.market.value]].drop_duplicates()
+        tkrs = [get_yfinance_sym(sym, market) for sym, market in instruments.itertuples(index=False)]
+        tkr_map = pd.Series(tkrs, index=pd.MultiIndex.from_frame(instruments))
+        order_tkrs = tkr_map.reindex(
+            pd.MultiIndex.from_frame(portfolio_order_df[[OrderColumns.sym.value, OrderColumns.market.value]])
+        ).to_numpy()
+
+        order_dates = pd.to_datetime(portfolio_order_df[OrderColumns.date.value]).dt.normalize()
+        start_dates = order_dates.groupby(order_tkrs).min()
+        # Looked up by instrument, the infos are not returned in the order they were asked for
+        pairs = list(instruments.itertuples(index=False, name=None))
+        infos = get_company_infos(pairs)
+        self.local_currencies = pd.Series([infos[pair][1] for pair in pairs], index=tkrs)
+
+        # One concat for the whole book instead of re-aligning the frames once per instrument, the histories are the
+        # run's shared ones when given
+        histories = {
+            tkr: (
+                timelines.history(sym, market, start_dates[tkr])
+                if timelines is not None
+                else get_historical_prices_with_dates(sym, market, start_dates[tkr], end_date)
+            )
+            for tkr, (sym, market) in zip(tkrs, instruments.itertuples(index=False))
+        }
+        local_prices = pd.concat({tkr: h[YFinanceColumns.price.value] for tkr, h in histories.items()}, axis=1)
+        local_prices = local_prices.sort_index()
+        self.dates = local_prices.index
+        self.instruments = pd.Index(tkrs)
+        local_prices = local_prices.reindex(columns=self.instruments).ffill().to_numpy()
+        local_dividends = (
+            pd.concat({tkr: h[YFinanceColumns.dividends.value] for tkr, h in histories.items()}, axis=1)
+            .reindex(index=self.dates, columns=self.instruments)
+            .fillna(0.0)
+            .to_numpy()
+        )
+
+        fx_rates = np.ones_like(local_prices)
+        if len(self.dates) and (self.local_currencies != book_currency).any():
+            rates = get_fx_matrix().rates(self.local_currencies.unique(), book_currency, self.dates[0], end_date)
+            rates = rates.reindex(self.dates, method="ffill").bfill()
+            fx_rates = rates[self.local_currencies.to_numpy()].to_numpy()
+
+        # Positions are the cumulative signed quantities as of each trading day, orders on other days counted from the
+        # next one. Every instrument column shares the book's dates.
+        calendar = TradingCalendar([self.dates] * len(self.instruments))
+        positions = calendar.cumulative(
+            self.instruments.get_indexer(order_tkrs),
+            order_dates,
+            portfolio_order_df[OrderColumns.qty.value].to_numpy(dtype=float),
+        )
+        positions = positions.reshape(len(self.instruments), len(self.dates)).T
+
+        prices = local_prices * fx_rates
+        values = np.nan_to_num(positions * prices)
+        total = values.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.where(total[:, None] != 0, values / total[:, None], 0.0)
+            asset_returns = np.zeros_like(prices)
+            asset_returns[:-1] = prices[1:] / prices[:-1] - 1
+        asset_returns = np.nan_to_num(asset_returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+        self._prices = prices
+        self._positions = positions
+        self._values = values
+        self._weights = weights
+        self._asset_returns = asset_returns
+        self._dividends = np.nan_to_num(positions * local_dividends * fx_rates)
+
+    def _frame(self, data: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(data, index=self.dates, columns=self.instruments)
+
+    @property
+    def prices(self) -> pd.DataFrame:
+        return self._frame(self._prices)
+
+    @property
+    def positions(self) -> pd.DataFrame:
+        return self._frame(self._positions)
+
+    @property
+    def values(self) -> pd.DataFrame:
+        return self._frame(self._values)
+
+    @property
+    def weights(self) -> pd.DataFrame:
+        return self._frame(self._weights)
+
+    @property
+    def asset_returns(self) -> pd.DataFrame:
+        # Return earned from each day's close to the next one
+        return self._frame(self._asset_returns)
+
+    @property
+    def dividends(self) -> pd.DataFrame:
+        return self._frame(self._dividends)
+
+    @property
+    def total_value(self) -> pd.Series:
+        return pd.Series(self._values.sum(axis=1), index=self.dates)
+
+    @property
+    def returns(self) -> pd.Series:
+        return pd.Series((self._weights * self._asset_returns).sum(axis=1), index=self.dates)
@@ -1,22 +1,32 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from portfolio_tracker.core import compute_portfolio_returns_over_time
+from portfolio_tracker.budget_utils import sankey_flows
 
 
-def plot_portfolio_returns(portfolio_order_df, start_date, book_currency, title, sheet):
+# matplotlib is only imported by the draw functions, which run when a chart is missing from the chart cache
+def draw_portfolio_returns(portfolio_returns, start_date, title):
+    import matplotlib.pyplot as plt
+
     fig = plt.figure(figsize=(10, 7))
     ax = fig.add_subplot(111)
-    portfolio_returns = compute_portfolio_returns_over_time(portfolio_order_df, book_currency)
     cumulative_returns = (1 + portfolio_returns).cumprod().shift(1)
     cumulative_returns.iloc[0] = 1
     mask = pd.to_datetime(cumulative_returns.index) >= start_date
     cumulative_returns[mask].plot(ax=ax)
     ax.set_title(title)
-    sheet.pictures.add(fig, name=title, update=True)
+    return fig
 
 
-def plot_donut_chart(labels, sizes, title, sheet):
+def plot_portfolio_returns(portfolio_returns, start_date, title, sheet):
+    sheet.add_chart(
+        title, draw_portfolio_returns, portfolio_returns=portfolio_returns, start_date=start_date, title=title
+    )
+
+
+def draw_donut_chart(labels, sizes, title):
+    import matplotlib.pyplot as plt
+
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot(111)
 
@@ -30,8 +40,69 @@ def plot_donut_chart(labels, sizes, title, sheet):
     # Equal aspect ratio ensures that pie is drawn as a circle
     ax.axis("equal")
     ax.set_title(title)
-    sheet.pictures.add(fig, name=title, update=True)
+    return fig
+
+
+def plot_donut_chart(labels, sizes, title, sheet):
+    sheet.add_chart(title, draw_donut_chart, labels=list(labels), sizes=list(sizes), title=title)
+
+
+def draw_sankey_diagram(nodes, links, title):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(14, 10))
+    ax = fig.add_subplot(111)
+    colors = plt.get_cmap("tab20")
+
+    # Each column is stacked from the top with a fixed gap between nodes, scaled so the tallest one fits
+    n_nodes = len(nodes)
+    size = np.maximum(
+        np.bincount(links["source"], weights=links["value"], minlength=n_nodes),
+        np.bincount(links["target"], weights=links["value"], minlength=n_nodes),
+    )
+    column = nodes["column"].to_numpy()
+    gap = 0.02
+    scale = min(
+        (1 - gap * (np.sum(column == c) - 1)) / size[column == c].sum()
+        for c in np.unique(column)
+        if size[column == c].sum()
+    )
+    top = np.zeros(n_nodes)
+    for c in np.unique(column):
+        heights = size[column == c] * scale
+        top[column == c] = 1 - np.concatenate([[0], np.cumsum(heights + gap)[:-1]])
+
+    node_width = 0.04
+    for i, (label, c) in enumerate(nodes.itertuples(index=False)):
+        ax.add_patch(
+            plt.Rectangle((c - node_width / 2, top[i] - size[i] * scale), node_width, size[i] * scale, color="grey")
+        )
+        ha, x = ("right", c - node_width) if c == 0 else ("left", c + node_width)
+        ax.text(x, top[i] - size[i] * scale / 2, label, ha=ha, va="center", fontsize=9)
+
+    # Links leave and enter their nodes in the order of the nodes they connect, as smooth bands
+    out_offset, in_offset = top.copy(), top.copy()
+    t = np.linspace(0, 1, 50)
+    smooth = 3 * t**2 - 2 * t**3
+    for source, target, value in links.sort_values(["source", "target"]).itertuples(index=False):
+        height = value * scale
+        x0, x1 = column[source] + node_width / 2, column[target] - node_width / 2
+        y0, y1 = out_offset[source], in_offset[target]
+        upper = y0 + (y1 - y0) * smooth
+        ax.fill_between(x0 + (x1 - x0) * t, upper - height, upper, color=colors(source % 20), alpha=0.5, lw=0)
+        out_offset[source] -= height
+        in_offset[target] -= height
+
+    ax.set_xlim(-0.5, 2.5)
+    ax.set_ylim(-0.05, 1.05)
+    ax.axis("off")
+    ax.set_title(title, fontsize=16, fontweight="bold")
+    return fig
 
 
 def plot_sankey_diagram(budget_history_df, sheet):
-    raise NotImplementedError
+    nodes, links = sankey_flows(budget_history_df)
+    if links.empty:
+        return
+    title = "Sankey Diagram of Budget History"
+    sheet.add_chart(title, draw_sankey_diagram, nodes=nodes, links=links, title=title)
@@ -2,10 +2,13 @@ import datetime as dt
 import numpy as np
 import pandas as pd
 
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
 from portfolio_tracker.constant import YFinanceColumns, OrderColumns
-from portfolio_tracker.utils import get_historical_prices_with_dates, get_company_info, get_forex_rates_series
+from portfolio_tracker.fx import get_forex_rates_series
+from portfolio_tracker.panel import PortfolioPanel
+from portfolio_tracker.timeline import InstrumentTimeline, Timelines
+from portfolio_tracker.utils import get_historical_prices_with_dates
 
 
 def compute_sharpe_ratio(historical_df) -> float:
@@ -14,96 +17,49 @@ def compute_sharpe_ratio(historical_df) -> float:
 
 
 def compute_position_value_and_dividend_over_time(asset_order_df: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
-    start_date = asset_order_df[OrderColumns.date.value].min()
     hist = get_historical_prices_with_dates(
         asset_order_df[OrderColumns.sym.value].iloc[0],
         asset_order_df[OrderColumns.market.value].iloc[0],
-        start_date=start_date,
+        start_date=asset_order_df[OrderColumns.date.value].min(),
         end_date=dt.date.today(),
-    ).reset_index()
-    hist[YFinanceColumns.date.value] = hist[YFinanceColumns.date.value].dt.date
-
-    asset_order_df[OrderColumns.date.value] = asset_order_df[OrderColumns.date.value].dt.date
-    positions_change = asset_order_df.set_index(OrderColumns.date.value)[OrderColumns.qty.value]
-
-    dividends = hist.set_index(YFinanceColumns.date.value)[YFinanceColumns.dividends.value]
-    capital_gain = hist.set_index(YFinanceColumns.date.value)[YFinanceColumns.price.value]
-
-    positions = pd.Series(0, index=dividends.index)
-    positions.loc[positions_change.index] = positions_change
-    positions = positions.cumsum()
-
-    dividends_earned = positions * dividends
-    position_value = positions * capital_gain
-    return position_value, dividends_earned
-
-
-def compute_asset_returns_over_time(
-    asset_order_df: pd.DataFrame, book_currency: str, start_date: dt.date, end_date: dt.date
-):
-    instrument_name, local_ccy = get_company_info(
-        asset_order_df[OrderColumns.sym.value].iloc[0], asset_order_df[OrderColumns.market.value].iloc[0]
     )
-
-    fx_rate = 1
-    if local_ccy != book_currency:
-        if local_ccy == "GBp" and book_currency == "GBP":
-            # fx_rate = 1 / 100
-            fx_rate /= 100
-
-        elif local_ccy == "GBp":
-            fx_rate = get_forex_rates_series("GBP", book_currency, start_date, end_date) / 100
-        else:
-            fx_rate = get_forex_rates_series(local_ccy, book_currency, start_date, end_date)
-
-    asset_value = (
-        get_historical_prices_with_dates(
-            asset_order_df[OrderColumns.sym.value].iloc[0],
-            asset_order_df[OrderColumns.market.value].iloc[0],
-            start_date,
-            end_date,
-        )
-    ).reset_index()
-    asset_value[YFinanceColumns.date.value] = asset_value[YFinanceColumns.date.value].dt.date
-    asset_value = asset_value.set_index(YFinanceColumns.date.value)[YFinanceColumns.price.value]
-    asset_value = asset_value.rename(instrument_name)
-    asset_value *= fx_rate
-    return asset_value.ffill().pct_change().shift(-1), fx_rate
-
-
-def compute_portfolio_returns_over_time(portfolio_order_df: pd.DataFrame, book_currency: str):
-    asset_orders = portfolio_order_df.groupby(OrderColumns.sym.value)
-    portfolio_positions_over_time = pd.DataFrame()
-    asset_return_over_time = pd.DataFrame()
-    end_date = dt.date.today()
-    for asset_name, asset_order_df in asset_orders:
-        position_value, _ = compute_position_value_and_dividend_over_time(asset_order_df)
-        position_value = position_value.rename(asset_name)
-        start_date = position_value.index.min()
-
-        asset_returns, fx_rate = compute_asset_returns_over_time(asset_order_df, book_currency, start_date, end_date)
-
-        position_value *= fx_rate
-
-        portfolio_positions_over_time = pd.concat([portfolio_positions_over_time, position_value], axis=1)
-        asset_return_over_time = pd.concat(
-            [
-                asset_return_over_time,
-                asset_returns.rename(asset_name),
-            ],
-            axis=1,
-        )
-
-    portfolio_positions_over_time = portfolio_positions_over_time.sort_index().ffill()
-    asset_return_over_time = asset_return_over_time.sort_index().fillna(0)
-    portfolio_positions_over_time = portfolio_positions_over_time.fillna(0)
-
-    # Normalize by total notional
-    z = portfolio_positions_over_time.sum(axis=1)
-    portfolio_weights_over_time = portfolio_positions_over_time.div(z.values, axis=0)
-
-    portfolio_return_over_time = (portfolio_weights_over_time * asset_return_over_time.fillna(0)).sum(axis=1)
-    return portfolio_return_over_time
+    timeline = InstrumentTimeline.from_orders(
+        hist, asset_order_df[OrderColumns.date.value], asset_order_df[OrderColumns.qty.value].to_numpy()
+    )
+    return timeline.value, timeline.dividend_flows
+
+
+def compute_portfolio_returns_over_time(
+    portfolio_order_df: pd.DataFrame, book_currency: str, timelines: Optional[Timelines] = None
+) -> pd.Series:
+    return PortfolioPanel(portfolio_order_df, book_currency, timelines=timelines).returns
+
+
+def consolidate_portfolio_returns(
+    portfolio_values: Dict[str, pd.Series],
+    portfolio_returns: Dict[str, pd.Series],
+    book_currencies: Dict[str, str],
+    reporting_currency: str,
+) -> pd.Series:
+    # Value-weighted combination of each book's returns once converted to the reporting currency,
+    # in O(portfolios x days) from the already evaluated value and return series
+    values, returns = {}, {}
+    for key, book_value in portfolio_values.items():
+        book_returns = portfolio_returns[key]
+        book_currency = book_currencies.get(key, reporting_currency)
+        if book_currency != reporting_currency and len(book_value):
+            fx_rate = get_forex_rates_series(book_currency, reporting_currency, book_value.index[0], dt.date.today())
+            fx_rate = fx_rate.reindex(book_value.index, method="ffill").bfill()
+            book_value = book_value * fx_rate
+            book_returns = (1 + book_returns) * (fx_rate.shift(-1) / fx_rate).fillna(1) - 1
+        values[key] = book_value
+        returns[key] = book_returns
+
+    values = pd.concat(values, axis=1).sort_index().ffill().fillna(0)
+    returns = pd.concat(returns, axis=1).reindex(values.index).fillna(0)
+    total = values.sum(axis=1)
+    weights = values.div(total.where(total != 0), axis=0).fillna(0)
+    return (weights * returns).sum(axis=1)
 
 
 def compute_backtest_metrics(returns_time_series: pd.Series) -> Tuple:
@@ -0,0 +1,97 @@
+import datetime as dt
+from typing import Dict
+
+import pandas as pd
+
+from portfolio_tracker.constant import FX_BASE_CURRENCY, MovementColumns, OrderColumns, PREFETCH_CHUNK_SIZE
+from portfolio_tracker.fetcher import get_fetcher
+from portfolio_tracker.fx import get_quoted_currency
+from portfolio_tracker.instrumentation import get_instrumentation
+from portfolio_tracker.providers import get_fx_sym, get_provider
+from portfolio_tracker.store import get_price_store
+from portfolio_tracker.utils import get_company_infos, get_yfinance_sym
+
+
+def collect_history_requests(
+    order_data: pd.DataFrame,
+    mvt_data: pd.DataFrame,
+    book_currencies: Dict[str, str],
+    reporting_currency: str,
+) -> Dict[str, pd.Timestamp]:
+    # Earliest date needed for every instrument and FX pair used later on in the run
+    requests = {}
+    spot_start = pd.Timestamp(dt.date.today() - dt.timedelta(days=5))
+
+    def request(tkr: str, start_date: pd.Timestamp):
+        requests[tkr] = min(pd.Timestamp(start_date), requests.get(tkr, pd.Timestamp(start_date)))
+
+    def request_fx(currency: str, start_date: pd.Timestamp):
+        # FX is only ever downloaded against FX_BASE_CURRENCY, the FX matrix derives the cross rates
+        currency, _ = get_quoted_currency(currency)
+        if currency != FX_BASE_CURRENCY:
+            request(get_fx_sym(FX_BASE_CURRENCY, currency), start_date)
+
+    first_order_dates = order_data.groupby(
+        [OrderColumns.sym.value, OrderColumns.market.value, OrderColumns.portfolio.value], observed=True
+    )[OrderColumns.date.value].min()
+    company_infos = get_company_infos(list(dict.fromkeys((sym, market) for sym, market, _ in first_order_dates.index)))
+    for (sym, market, portfolio_key), start_date in first_order_dates.items():
+        request(get_yfinance_sym(sym, market), start_date)
+
+        _, local_ccy = company_infos[(sym, market)]
+        request_fx(local_ccy, start_date)
+        request_fx(book_currencies.get(portfolio_key, reporting_currency), start_date)
+
+    request_fx(reporting_currency, spot_start)
+    for ccy in mvt_data[MovementColumns.currency.value].unique():
+        request_fx(ccy, spot_start)
+    return requests
+
+
+def prefetch_histories(requests: Dict[str, pd.Timestamp], end_date: dt.date, chunk_size: int = PREFETCH_CHUNK_SIZE):
+    provider = get_provider()
+    if not provider.persistent:
+        return
+
+    store = get_price_store()
+    missing = []
+    for tkr, start_date in requests.items():
+        missing += [(start, end, tkr) for start, end in store.missing_ranges(tkr, start_date, end_date)]
+
+    # Chunks of tickers with close start dates share one multi-ticker download spanning all their missing ranges,
+    # the chunks themselves are downloaded concurrently on the fetcher's pool
+    missing = sorted(missing)
+    fetcher = get_fetcher()
+    downloads = []
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i : i + chunk_size]
+        chunk_start = min(start for start, _, _ in chunk)
+        chunk_end = max(end for _, end, _ in chunk)
+        tkrs = tuple(dict.fromkeys(tkr for _, _, tkr in chunk))
+        future = fetcher.submit(
+            ("download", tkrs, chunk_start, chunk_end), provider.download, list(tkrs), chunk_start, chunk_end
+        )
+        downloads.append((future, chunk_start, chunk_end))
+
+    # Only tickers that came back with rows are persisted. An empty result, typically an error swallowed by the
+    # download, leaves the ticker's ranges missing so they are requested again one ticker at a time when read.
+    for future, chunk_start, chunk_end in downloads:
+        for tkr, df in future.result().items():
+            if df is None or df.empty:
+                get_instrumentation().count("prefetch.empty")
+                continue
+            store.write(tkr, df, chunk_start, chunk_end)
+
+    for tkr in requests:
+        store.load(tkr)
+
+
+def prefetch_market_data(
+    order_data: pd.DataFrame,
+    mvt_data: pd.DataFrame,
+    book_currencies: Dict[str, str],
+    reporting_currency: str,
+    chunk_size: int = PREFETCH_CHUNK_SIZE,
+):
+    requests = collect_history_requests(order_data, mvt_data, book_currencies, reporting_currency)
+    prefetch_histories(requests, dt.date.today(), chunk_size)
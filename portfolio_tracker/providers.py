@@ -0,0 +1,180 @@
+import datetime as dt
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from portfolio_tracker.instrumentation import get_instrumentation
+from portfolio_tracker.store import normalize_history
+
+
+def get_fx_sym(base_currency: str, target_currency: str) -> str:
+    return base_currency + target_currency + "=X"  # Append "=X" to the currency pair for Yahoo Finance
+
+
+class MarketDataProvider(ABC):
+    # Whether the data layer should persist what this provider serves in the on-disk price store
+    persistent = True
+    # Whether requests hit the network, and so go through the rate-limited fetcher
+    remote = True
+
+    @abstractmethod
+    def history(self, tkr: str, start_date: dt.date, end_date: dt.date) -> pd.DataFrame:
+        pass
+
+    @abstractmethod
+    def info(self, tkr: str) -> Dict:
+        pass
+
+    def fx_history(self, base_currency: str, target_currency: str, start_date: dt.date, end_date: dt.date):
+        return self.history(get_fx_sym(base_currency, target_currency), start_date, end_date)
+
+    def download(self, tkrs: List[str], start_date: dt.date, end_date: dt.date) -> Dict[str, pd.DataFrame]:
+        return {tkr: self.history(tkr, start_date, end_date) for tkr in tkrs}
+
+
+def _count_download(df: Optional[pd.DataFrame]):
+    # Bytes are estimated from the size of the decoded frame, yfinance does not expose the response sizes
+    get_instrumentation().count("network.calls")
+    if df is not None:
+        get_instrumentation().count("network.bytes", int(df.memory_usage(index=True).sum()))
+
+
+class YFinanceProvider(MarketDataProvider):
+    def history(self, tkr: str, start_date: dt.date, end_date: dt.date) -> pd.DataFrame:
+        import yfinance as yf
+
+        ticker = yf.Ticker(tkr)
+        df = ticker.history(start=start_date, end=end_date)
+        _count_download(df)
+        return df
+
+    def info(self, tkr: str) -> Dict:
+        import yfinance as yf
+
+        ticker = yf.Ticker(tkr)
+        info = ticker.info
+        get_instrumentation().count("network.calls")
+        get_instrumentation().count("network.bytes", len(json.dumps(info, default=str)))
+        return info
+
+    def download(self, tkrs: List[str], start_date: dt.date, end_date: dt.date) -> Dict[str, pd.DataFrame]:
+        import yfinance as yf
+
+        # One multi-ticker request, with the same adjustments and actions as Ticker.history
+        data = yf.download(
+            tkrs,
+            start=start_date,
+            end=end_date,
+            actions=True,
+            auto_adjust=True,
+            group_by="ticker",
+            progress=False,
+        )
+        _count_download(data)
+        if data is None or data.empty:
+            return {tkr: pd.DataFrame() for tkr in tkrs}
+        if not isinstance(data.columns, pd.MultiIndex):
+            data = pd.concat({tkrs[0]: data}, axis=1)
+
+        histories = {}
+        for tkr in tkrs:
+            df = data[tkr] if tkr in data.columns.get_level_values(0) else pd.DataFrame()
+            histories[tkr] = df.dropna(how="all")
+        return histories
+
+
+# Serves market data offline from a directory laid out as `history/<ticker>.csv` and `info.json`.
+# Histories and infos can also be added in memory, e.g. to replay synthetic data.
+class ReplayProvider(MarketDataProvider):
+    persistent = False
+    remote = False
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._histories: Dict[str, pd.DataFrame] = {}
+        self._infos: Dict[str, Dict] = {}
+        if directory is not None and os.path.exists(os.path.join(directory, "info.json")):
+            with open(os.path.join(directory, "info.json"), "r") as f:
+                self._infos = json.load(f)
+
+    def add_history(self, tkr: str, df: pd.DataFrame):
+        self._histories[tkr] = normalize_history(df)
+
+    def add_info(self, tkr: str, info: Dict):
+        self._infos[tkr] = info
+
+    def _load_history(self, tkr: str) -> pd.DataFrame:
+        if tkr not in self._histories:
+            path = os.path.join(self.directory or "", "history", f"{tkr}.csv")
+            if self.directory is None or not os.path.exists(path):
+                raise KeyError(f"No recorded history for {tkr}.")
+            self._histories[tkr] = normalize_history(pd.read_csv(path, index_col=0, parse_dates=True))
+        return self._histories[tkr]
+
+    def history(self, tkr: str, start_date: dt.date, end_date: dt.date) -> pd.DataFrame:
+        df = self._load_history(tkr)
+        return df[(df.index >= pd.Timestamp(start_date)) & (df.index < pd.Timestamp(end_date))].copy()
+
+    def info(self, tkr: str) -> Dict:
+        if tkr not in self._infos:
+            raise KeyError(f"No recorded info for {tkr}.")
+        return self._infos[tkr]
+
+
+# Forwards every request to `provider` and records the answers in a directory readable by ReplayProvider.
+class RecordingProvider(MarketDataProvider):
+    def __init__(self, provider: MarketDataProvider, directory: str):
+        self.provider = provider
+        self.directory = directory
+        self.persistent = provider.persistent
+        self.remote = provider.remote
+        self._lock = threading.Lock()
+        self._replay = ReplayProvider(directory)
+        os.makedirs(os.path.join(directory, "history"), exist_ok=True)
+
+    def _record_history(self, tkr: str, df: pd.DataFrame):
+        with self._lock:
+            try:
+                recorded = pd.concat([self._replay._load_history(tkr), normalize_history(df)])
+            except KeyError:
+                recorded = df
+            self._replay.add_history(tkr, recorded)
+            self._replay._load_history(tkr).to_csv(os.path.join(self.directory, "history", f"{tkr}.csv"))
+
+    def history(self, tkr: str, start_date: dt.date, end_date: dt.date) -> pd.DataFrame:
+        df = self.provider.history(tkr, start_date, end_date)
+        self._record_history(tkr, df)
+        return df
+
+    def download(self, tkrs: List[str], start_date: dt.date, end_date: dt.date) -> Dict[str, pd.DataFrame]:
+        histories = self.provider.download(tkrs, start_date, end_date)
+        for tkr, df in histories.items():
+            self._record_history(tkr, df)
+        return histories
+
+    def info(self, tkr: str) -> Dict:
+        info = self.provider.info(tkr)
+        with self._lock:
+            self._replay.add_info(tkr, {"longName": info["longName"], "currency": info["currency"]})
+            with open(os.path.join(self.directory, "info.json"), "w") as f:
+                json.dump(self._replay._infos, f, indent=2)
+        return info
+
+
+_provider: MarketDataProvider = None
+
+
+def get_provider() -> MarketDataProvider:
+    global _provider
+    if _provider is None:
+        _provider = YFinanceProvider()
+    return _provider
+
+
+def set_provider(provider: MarketDataProvider):
+    global _provider
+    _provider = provider
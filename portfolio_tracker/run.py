@@ -1,9 +1,7 @@
 import datetime as dt
-import matplotlib
 import pandas as pd
-import xlwings as xw
 
-from typing import Dict
+from typing import Callable, Dict, Optional
 
 from portfolio_tracker.constant import (
     OrderColumns,
@@ -12,70 +10,123 @@ from portfolio_tracker.constant import (
     CashAccountSummary,
     PortfolioSummary,
     PORTFOLIO_DISPLAY_ORDER,
+    BUDGET_HELP_TEXT,
+    COST_BASIS_METHOD,
+    CostBasisMethod,
+    FETCH_MAX_WORKERS,
+    FETCH_REQUESTS_PER_SECOND,
+    RUN_REPORT_PATH,
 )
 from portfolio_tracker.budget_utils import (
     preprocess_budget_data,
-    get_income,
-    get_expenses,
-    plot_income_category,
-    plot_expenses_category,
+    plot_category_pies,
+    render_budget,
     update_budget,
 )
 
-from portfolio_tracker.utils import (
-    read_table,
-    save_dataframe,
-)
+from portfolio_tracker.store import get_result_store
+from portfolio_tracker.utils import fingerprint_portfolio, table_values_to_frame
 
 from portfolio_tracker.core import (
-    compute_signed_quantity,
     aggregate_orders_to_portfolio_df,
     build_cash_accounts_summary,
     build_portfolio_analytics,
     build_portfolio_summary,
 )
-from portfolio_tracker.plot import plot_donut_chart, plot_portfolio_returns
+from portfolio_tracker.context import RunContext
+from portfolio_tracker.fetcher import configure_fetcher
+from portfolio_tracker.fx import FxMatrix, set_fx_matrix
+from portfolio_tracker.instrumentation import Instrumentation, get_instrumentation, profiled, set_instrumentation
+from portfolio_tracker.ledger import Ledger
+from portfolio_tracker.plot import plot_donut_chart, plot_portfolio_returns, plot_sankey_diagram
+from portfolio_tracker.prefetch import prefetch_market_data
+from portfolio_tracker.writers import SheetWriter, WorkbookWriter, XlwingsWorkbookWriter
 
-matplotlib.use("Agg")
 
+def run_portfolios(
+    order_data: pd.DataFrame,
+    mvt_data: pd.DataFrame,
+    book_currencies: Dict[str, str],
+    reporting_currency: str,
+    writer: WorkbookWriter,
+    incremental: bool = False,
+    cost_basis_method: CostBasisMethod = COST_BASIS_METHOD,
+    summary_sheet_name: str = "Summary",
+):
+    origin = "B2"
+    summary_sheet = writer.sheet(summary_sheet_name)
+    instrumentation = get_instrumentation()
 
-def main(book_currencies: Dict[str, str], reporting_currency: str = "EUR"):
-    wb = xw.Book.caller()
-    mvt_sheet = wb.sheets["Movements"]
-    order_sheet = wb.sheets["Orders"]
-    summary_sheet = wb.sheets["Summary"]
-    budget_sheet = wb.sheets["Budget"]
+    # Orders and movements are typed and indexed by portfolio, instrument and account once for the whole run
+    with instrumentation.stage("run.ledger"):
+        mvt_data.drop(MovementColumns.desc.value, inplace=True, axis=1, errors="ignore")
+        movements = Ledger(mvt_data, MovementColumns)
 
-    origin = "B2"
+        order_data.drop(OrderColumns.instrument.value, inplace=True, axis=1, errors="ignore")
+        orders = Ledger(order_data, OrderColumns)
 
-    mvt_data = read_table(origin, mvt_sheet).reset_index()
-    mvt_data.drop(MovementColumns.desc.value, inplace=True, axis=1)
-    mvt_data = compute_signed_quantity(mvt_data, MovementColumns)
+    # Download every price and FX history needed by the run in bulk, later lookups are served from the store
+    with instrumentation.stage("run.prefetch"):
+        prefetch_market_data(orders.df, movements.df, book_currencies, reporting_currency)
 
-    order_data = read_table(origin, order_sheet).reset_index()
-    order_data.drop(OrderColumns.instrument.value, inplace=True, axis=1)
-    order_data = compute_signed_quantity(order_data, OrderColumns)
+    # Each portfolio's return series is computed once and shared by its charts and the summary metrics
+    context = RunContext(orders, book_currencies, reporting_currency)
+
+    # In incremental mode, portfolios whose orders and market data are unchanged are served from the last run
+    fingerprints, cached_results = {}, {}
+    if incremental:
+        result_store = get_result_store()
+        for portfolio_key in context.portfolio_keys:
+            with instrumentation.stage("run.fingerprint"):
+                fingerprints[portfolio_key] = fingerprint_portfolio(
+                    context.portfolio_orders(portfolio_key), context.book_currency(portfolio_key), cost_basis_method
+                )
+                results = result_store.get(portfolio_key, fingerprints[portfolio_key])
+            instrumentation.count("cache.results.misses" if results is None else "cache.results.hits")
+            if results is not None:
+                cached_results[portfolio_key] = results
+                context.seed(portfolio_key, results["returns"], results["value"])
 
     # Generate each portfolio's individual page
-    portfolios = aggregate_orders_to_portfolio_df(order_data)
-    for portfolio_key, portfolio_df in portfolios.items():
-        book_ccy = book_currencies.get(portfolio_key, reporting_currency)
-        portfolio_df = build_portfolio_analytics(portfolio_df, book_ccy)
-        to_sheet = wb.sheets[portfolio_key]
-        save_dataframe(portfolio_df[PORTFOLIO_DISPLAY_ORDER], origin, to_sheet, index=False)
+    with instrumentation.stage("run.aggregate"):
+        portfolios = aggregate_orders_to_portfolio_df(
+            orders,
+            [key for key in context.portfolio_keys if key not in cached_results],
+            cost_basis_method,
+            context.timelines,
+        )
+    for portfolio_key in context.portfolio_keys:
+        book_ccy = context.book_currency(portfolio_key)
+        if portfolio_key in cached_results:
+            portfolios[portfolio_key] = cached_results[portfolio_key]["portfolio"]
+            portfolio_df = cached_results[portfolio_key]["analytics"]
+        else:
+            with instrumentation.stage("run.analytics"):
+                portfolio_df = build_portfolio_analytics(portfolios[portfolio_key], book_ccy, context.timelines)
+            with instrumentation.stage("run.returns"):
+                context.portfolio_returns(portfolio_key)
+            if incremental:
+                result_store.put(
+                    portfolio_key,
+                    fingerprints[portfolio_key],
+                    {
+                        "portfolio": portfolios[portfolio_key],
+                        "analytics": portfolio_df,
+                        "returns": context.portfolio_returns(portfolio_key),
+                        "value": context.portfolio_value(portfolio_key),
+                    },
+                )
+        to_sheet = writer.sheet(portfolio_key)
+        to_sheet.write_table(portfolio_df[PORTFOLIO_DISPLAY_ORDER], origin, index=False)
         plot_portfolio_returns(
-            portfolio_order_df=order_data[order_data[OrderColumns.portfolio.value] == portfolio_key],
-            start_date=order_data.loc[
-                order_data[OrderColumns.portfolio.value] == portfolio_key, OrderColumns.date.value
-            ].min(),
-            book_currency=book_ccy,
+            portfolio_returns=context.portfolio_returns(portfolio_key),
+            start_date=context.inception_date(portfolio_key),
             title="Portfolio performance since inception",
             sheet=to_sheet,
         )
         plot_portfolio_returns(
-            portfolio_order_df=order_data[order_data[OrderColumns.portfolio.value] == portfolio_key],
+            portfolio_returns=context.portfolio_returns(portfolio_key),
             start_date=pd.to_datetime(dt.date.today() - dt.timedelta(days=365)),
-            book_currency=book_ccy,
             title="Portfolio 1Y",
             sheet=to_sheet,
         )
@@ -87,24 +138,27 @@ def main(book_currencies: Dict[str, str], reporting_currency: str = "EUR"):
         )
 
     # Compute the overall investment resume
-    cash_accounts_summary = build_cash_accounts_summary(
-        mvt_data, order_data, portfolios, book_currencies, reporting_currency
-    )
-    save_dataframe(cash_accounts_summary, "B8", summary_sheet, index=False)
-    portfolio_summary = build_portfolio_summary(order_data, portfolios, book_currencies, reporting_currency)
-    save_dataframe(portfolio_summary, "B20", summary_sheet, index=False)
+    with instrumentation.stage("run.summaries"):
+        cash_accounts_summary = build_cash_accounts_summary(
+            movements, orders, portfolios, book_currencies, reporting_currency
+        )
+        summary_sheet.write_table(cash_accounts_summary, "B8", index=False)
+        portfolio_summary = build_portfolio_summary(
+            orders, portfolios, book_currencies, reporting_currency, context.all_portfolio_returns()
+        )
+        summary_sheet.write_table(portfolio_summary, "B20", index=False)
+    with instrumentation.stage("run.consolidated_returns"):
+        context.consolidated_returns()
 
     plot_portfolio_returns(
-        portfolio_order_df=order_data,
+        portfolio_returns=context.consolidated_returns(),
         start_date=pd.to_datetime(dt.date.today() - dt.timedelta(days=365)),
-        book_currency=reporting_currency,
         title="Portfolio performance 1Y",
         sheet=summary_sheet,
     )
     plot_portfolio_returns(
-        portfolio_order_df=order_data,
-        start_date=order_data[OrderColumns.date.value].min(),
-        book_currency=reporting_currency,
+        portfolio_returns=context.consolidated_returns(),
+        start_date=context.inception_date(),
         title="Portfolio performance since inception",
         sheet=summary_sheet,
     )
@@ -117,29 +171,91 @@ def main(book_currencies: Dict[str, str], reporting_currency: str = "EUR"):
         sheet=summary_sheet,
     )
 
-    # Budget sheet
-    budget_sheet.range("A1").value = (
-        "To import a bank account history, either paste your history starting from B2 cell and specify headers in constant.py, or go to Developer > Insert > Button, and link the button to the import_csv() function in budget_utils.py "
-    )
-    budget_history_df = read_table("B2", budget_sheet, index=0, header=1).reset_index()
+
+def run_budget(
+    budget_history_df: pd.DataFrame,
+    budget_sheet: SheetWriter,
+    window=None,
+    render: Optional[Callable[[pd.DataFrame], None]] = None,
+):
+    # Steps shared by the Excel and the headless runs, `render` draws the windowed totals and category pies from the
+    # preprocessed table in place of `render_budget`
+    budget_sheet.write_value("A1", BUDGET_HELP_TEXT)
     if not budget_history_df.empty:
-        budget_history_df = preprocess_budget_data(budget_history_df)
-        update_budget()
-
-        # Add the dropdown menu to cell O2
-        cell = budget_sheet.range("O2").api
-        options = "All time, Last 30 days, Last 90 days, Last 180 days, Last 365 days, Year to date"
-        cell.Validation.Delete()
-        cell.Validation.Add(Type=3, AlertStyle=2, Operator=1, Formula1=options)
-        cell.Validation.IgnoreBlank = True
-        cell.Validation.InCellDropdown = True
-
-        income = get_income(budget_history_df)
-        expenses = get_expenses(budget_history_df)
-
-        plot_income_category(income, budget_sheet)
-        plot_income_category(income, budget_sheet, subcategory=True)
-        plot_expenses_category(expenses, budget_sheet)
-        plot_expenses_category(expenses, budget_sheet, subcategory=True)
-
-    print("Done")
+        with get_instrumentation().stage("run.budget"):
+            budget_history_df = preprocess_budget_data(budget_history_df)
+            if render is None:
+                render_budget(budget_history_df, budget_sheet, window)
+            else:
+                render(budget_history_df)
+            plot_sankey_diagram(budget_history_df, budget_sheet)
+
+
+def write_run_report(writer: WorkbookWriter, report_path: Optional[str]):
+    instrumentation = get_instrumentation()
+    instrumentation.set("excel.round_trips", writer.round_trips)
+    instrumentation.set("charts.rendered", writer.charts_rendered)
+    if report_path:
+        instrumentation.write_json(report_path)
+
+
+def main(
+    book_currencies: Dict[str, str],
+    reporting_currency: str = "EUR",
+    max_workers: int = FETCH_MAX_WORKERS,
+    requests_per_second: float = FETCH_REQUESTS_PER_SECOND,
+    incremental: bool = False,
+    report_path: Optional[str] = RUN_REPORT_PATH,
+    diagnostics: bool = False,
+    profile_path: Optional[str] = None,
+    cost_basis_method: CostBasisMethod = COST_BASIS_METHOD,
+):
+    import xlwings as xw
+
+    set_instrumentation(Instrumentation())
+    # FX histories loaded by a previous run of the session end on the day it ran
+    set_fx_matrix(FxMatrix())
+    instrumentation = get_instrumentation()
+    configure_fetcher(max_workers, requests_per_second)
+    # Every write is queued on the writer and flushed in blocks on close, with screen updating and automatic
+    # calculation suspended in between
+    writer = XlwingsWorkbookWriter(xw.Book.caller())
+    with profiled(profile_path):
+        try:
+            origin = "B2"
+
+            with instrumentation.stage("run.read_inputs"):
+                mvt_data = writer.sheet("Movements").read_table(origin).reset_index()
+                order_data = writer.sheet("Orders").read_table(origin).reset_index()
+            run_portfolios(
+                order_data, mvt_data, book_currencies, reporting_currency, writer, incremental, cost_basis_method
+            )
+
+            # Budget sheet, the Excel run keeps the cube the O2 dropdown answers from
+            budget_sheet = writer.sheet("Budget")
+            budget_values = budget_sheet.read_table_values("B2")
+
+            def render_budget_sheet(budget_history_df: pd.DataFrame):
+                cube = update_budget(writer, budget_history_df, budget_values)
+
+                # Add the dropdown menu to cell O2
+                budget_sheet.add_dropdown(
+                    "O2",
+                    ["All time", "Last 30 days", "Last 90 days", "Last 180 days", "Last 365 days", "Year to date"],
+                )
+
+                plot_category_pies(cube, budget_sheet)
+
+            run_budget(table_values_to_frame(budget_values), budget_sheet, render=render_budget_sheet)
+
+            # Timings up to the final flush of the workbook, the JSON report covers the whole run
+            if diagnostics:
+                writer.sheet("Diagnostics", create=True).write_table(instrumentation.to_frame(), "B2", index=False)
+        finally:
+            writer.close()
+
+    write_run_report(writer, report_path)
+    print(
+        f"Done in {writer.round_trips} Excel round trips, "
+        f"{writer.charts_from_cache} of {writer.charts_rendered + writer.charts_from_cache} charts served from cache"
+    )
@@ -0,0 +1,329 @@
+import datetime as dt
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.constant import CACHE_DIR, CHART_CACHE_MAX_AGE, METADATA_TTL, YFinanceColumns
+
+# Daily bars are persisted under the enum member names, the full frame is rebuilt with the yfinance labels
+HISTORY_COLUMNS = [c for c in YFinanceColumns if c is not YFinanceColumns.date]
+
+
+def _to_timestamp(date) -> pd.Timestamp:
+    ts = pd.Timestamp(date)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts.normalize()
+
+
+def _has_trading_days(start: pd.Timestamp, end: pd.Timestamp) -> bool:
+    # Whether [start, end) has a weekday, a range without any legitimately comes back empty
+    return start < end and len(pd.bdate_range(start, end - pd.Timedelta(days=1))) > 0
+
+
+def normalize_history(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reindex(columns=[c.value for c in HISTORY_COLUMNS])
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    df.index = index.normalize().rename(YFinanceColumns.date.value)
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+class PriceStore:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._coverage: Dict[str, Optional[Tuple[pd.Timestamp, pd.Timestamp]]] = {}
+
+        columns = ", ".join(f"{c.name} REAL" for c in HISTORY_COLUMNS)
+        with self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS prices (ticker TEXT, date TEXT, {columns}, PRIMARY KEY (ticker, date))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS coverage (ticker TEXT PRIMARY KEY, start TEXT, end TEXT)")
+
+    def coverage(self, ticker: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        with self._lock:
+            if ticker not in self._coverage:
+                row = self._conn.execute("SELECT start, end FROM coverage WHERE ticker = ?", (ticker,)).fetchone()
+                self._coverage[ticker] = (pd.Timestamp(row[0]), pd.Timestamp(row[1])) if row else None
+            return self._coverage[ticker]
+
+    def load(self, ticker: str) -> pd.DataFrame:
+        with self._lock:
+            if ticker not in self._frames:
+                df = pd.read_sql_query(
+                    "SELECT * FROM prices WHERE ticker = ? ORDER BY date", self._conn, params=(ticker,)
+                )
+                df = df.drop(columns="ticker").set_index("date")
+                df.index = pd.to_datetime(df.index)
+                df = df.rename(columns={c.name: c.value for c in HISTORY_COLUMNS}).astype(float)
+                self._frames[ticker] = normalize_history(df)
+            return self._frames[ticker]
+
+    def missing_ranges(self, ticker: str, start_date, end_date) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        start, end = _to_timestamp(start_date), _to_timestamp(end_date)
+        covered = self.coverage(ticker)
+        # Coverage without a single stored row comes from a failed download, it is requested again in full
+        if covered is not None and self.load(ticker).empty:
+            covered = None
+        if covered is None:
+            return [(start, end)] if start < end else []
+
+        missing = []
+        if start < covered[0]:
+            missing.append((start, covered[0]))
+        if end > covered[1]:
+            missing.append((covered[1], end))
+        return missing
+
+    def write(self, ticker: str, df: pd.DataFrame, start_date, end_date) -> bool:
+        start, end = _to_timestamp(start_date), _to_timestamp(end_date)
+        df = normalize_history(df)
+        # Nothing came back for days that should have had bars, e.g. an error swallowed by the provider. The range
+        # is not marked as covered so the next read requests it again.
+        if df.empty and _has_trading_days(start, end):
+            return False
+        rows = [
+            (ticker, date.strftime("%Y-%m-%d"), *[None if pd.isna(v) else float(v) for v in values])
+            for date, values in zip(df.index, df.itertuples(index=False))
+        ]
+        with self._lock:
+            covered = self.coverage(ticker)
+            if covered is not None:
+                start, end = min(start, covered[0]), max(end, covered[1])
+            placeholders = ", ".join("?" * (len(HISTORY_COLUMNS) + 2))
+            with self._conn:
+                self._conn.executemany(f"INSERT OR REPLACE INTO prices VALUES ({placeholders})", rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)",
+                    (ticker, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")),
+                )
+            self._coverage[ticker] = (start, end)
+            if ticker in self._frames:
+                self._frames[ticker] = normalize_history(pd.concat([self._frames[ticker], df]))
+        return True
+
+    def get_history(
+        self, ticker: str, start_date, end_date, fetch: Callable[[str, pd.Timestamp, pd.Timestamp], pd.DataFrame]
+    ) -> pd.DataFrame:
+        # Only the ranges never downloaded before are requested, typically the tail since the last run
+        for missing_start, missing_end in self.missing_ranges(ticker, start_date, end_date):
+            self.write(ticker, fetch(ticker, missing_start, missing_end), missing_start, missing_end)
+
+        df = self.load(ticker)
+        start, end = _to_timestamp(start_date), _to_timestamp(end_date)
+        return df[(df.index >= start) & (df.index < end)].copy()
+
+
+class MetadataStore:
+    def __init__(self, path: str, ttl: dt.timedelta = METADATA_TTL):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._entries: Dict[str, Tuple[str, str, dt.datetime]] = {}
+
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (ticker TEXT PRIMARY KEY, name TEXT, currency TEXT, fetched_at TEXT)"
+            )
+
+    def get(self, ticker: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            if ticker not in self._entries:
+                row = self._conn.execute(
+                    "SELECT name, currency, fetched_at FROM metadata WHERE ticker = ?", (ticker,)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._entries[ticker] = (row[0], row[1], dt.datetime.fromisoformat(row[2]))
+
+            name, currency, fetched_at = self._entries[ticker]
+            if dt.datetime.now() - fetched_at > self.ttl:
+                return None
+            return name, currency
+
+    def put(self, ticker: str, name: str, currency: str) -> Tuple[str, str]:
+        fetched_at = dt.datetime.now()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+                    (ticker, name, currency, fetched_at.isoformat()),
+                )
+            self._entries[ticker] = (name, currency, fetched_at)
+        return name, currency
+
+
+# Per-portfolio results of a previous run, served back as long as the portfolio's fingerprint is unchanged
+class ResultStore:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str, fingerprint: str) -> Optional[Dict]:
+        if not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), "rb") as f:
+            entry = pickle.load(f)
+        return entry["results"] if entry["fingerprint"] == fingerprint else None
+
+    def put(self, key: str, fingerprint: str, results: Dict):
+        with open(self._path(key), "wb") as f:
+            pickle.dump({"fingerprint": fingerprint, "results": results}, f)
+
+
+# Rendered charts by content key, plus the key of the picture last placed at each location of a workbook so
+# unchanged pictures are left alone
+class ChartCache:
+    def __init__(self, directory: str, max_age: dt.timedelta = CHART_CACHE_MAX_AGE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_age = max_age
+        self._placed_path = os.path.join(directory, "placed.json")
+        self._placed = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not os.path.exists(self._path(key)):
+            return None
+        os.utime(self._path(key))
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def put(self, key: str, image: bytes):
+        with open(self._path(key), "wb") as f:
+            f.write(image)
+
+    def placed(self, location: str) -> Optional[str]:
+        if self._placed is None:
+            self._placed = {}
+            if os.path.exists(self._placed_path):
+                with open(self._placed_path) as f:
+                    self._placed = json.load(f)
+        return self._placed.get(location)
+
+    def mark_placed(self, location: str, key: str):
+        self.placed(location)
+        self._placed[location] = key
+        with open(self._placed_path, "w") as f:
+            json.dump(self._placed, f)
+
+    def prune(self):
+        # Drops the images not used within max_age
+        expiry = (dt.datetime.now() - self.max_age).timestamp()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png") and entry.stat().st_mtime < expiry:
+                os.remove(entry.path)
+
+
+# Hashes of the rows already imported into a table, with the number of rows the table had after the last import so
+# edits made in the sheet since can be detected
+class RowHashIndex:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS hashes (hash INTEGER PRIMARY KEY)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._hashes = np.fromiter((row[0] for row in self._conn.execute("SELECT hash FROM hashes")), dtype=np.int64)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()
+        self.rows = None if row is None else row[0]
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        return np.isin(hashes, self._hashes)
+
+    def add(self, hashes: np.ndarray, rows: int):
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?)", ((int(h),) for h in hashes))
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('rows', ?)", (rows,))
+        self._hashes = np.concatenate([self._hashes, hashes])
+        self.rows = rows
+
+    def rebuild(self, hashes: np.ndarray, rows: int):
+        with self._conn:
+            self._conn.execute("DELETE FROM hashes")
+        self._hashes = np.empty(0, dtype=np.int64)
+        self.add(np.unique(hashes), rows)
+
+
+_price_store = None
+_metadata_store = None
+_result_store = None
+_chart_cache = None
+_budget_store = None
+
+
+def get_price_store() -> PriceStore:
+    global _price_store
+    if _price_store is None:
+        _price_store = PriceStore(os.path.join(CACHE_DIR, "prices.sqlite"))
+    return _price_store
+
+
+def get_metadata_store() -> MetadataStore:
+    global _metadata_store
+    if _metadata_store is None:
+        _metadata_store = MetadataStore(os.path.join(CACHE_DIR, "metadata.sqlite"))
+    return _metadata_store
+
+
+def get_result_store() -> ResultStore:
+    global _result_store
+    if _result_store is None:
+        _result_store = ResultStore(os.path.join(CACHE_DIR, "results"))
+    return _result_store
+
+
+def get_chart_cache() -> ChartCache:
+    global _chart_cache
+    if _chart_cache is None:
+        _chart_cache = ChartCache(os.path.join(CACHE_DIR, "charts"))
+    return _chart_cache
+
+
+def get_budget_store() -> ResultStore:
+    global _budget_store
+    if _budget_store is None:
+        _budget_store = ResultStore(os.path.join(CACHE_DIR, "budget"))
+    return _budget_store
+
+
+def table_key(table: str) -> str:
+    # File name of what is persisted for an imported table, e.g. for a workbook path
+    return hashlib.sha1(table.encode()).hexdigest()[:16]
+
+
+def table_signature(values: List) -> str:
+    # Content hash of the raw values of a table, changes with any edited, added or removed cell
+    return hashlib.sha1(pickle.dumps(values, protocol=4)).hexdigest()
+
+
+def rows_signature(hashes: np.ndarray) -> str:
+    # Content hash of a table from the hashes of its rows, which an import extends with the rows it appends without
+    # reading the table back
+    return hashlib.sha1(np.asarray(hashes, dtype=np.int64).tobytes()).hexdigest()
+
+
+def get_row_hash_index(table: str) -> RowHashIndex:
+    # One index per imported table
+    return RowHashIndex(os.path.join(CACHE_DIR, "imports", f"{table_key(table)}.sqlite"))
@@ -0,0 +1,86 @@
+import datetime as dt
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.constant import OrderColumns, YFinanceColumns
+from portfolio_tracker.ledger import Ledger
+from portfolio_tracker.trading_calendar import TradingCalendar
+from portfolio_tracker.utils import get_historical_prices_with_dates
+
+
+# Daily position of a portfolio in an instrument over the instrument's trading days, with its value and the
+# dividends it earned, in the instrument's currency
+class InstrumentTimeline:
+    def __init__(self, history: pd.DataFrame, position: np.ndarray):
+        self.dates = history.index
+        self.prices = history[YFinanceColumns.price.value]
+        self.dividends_per_share = history[YFinanceColumns.dividends.value]
+        self.position = pd.Series(position, index=self.dates)
+
+    @classmethod
+    def from_orders(cls, history: pd.DataFrame, order_dates, quantities) -> "InstrumentTimeline":
+        # Quantity held at each close, orders on a non trading day counted from the next one
+        calendar = TradingCalendar([history.index])
+        return cls(history, calendar.cumulative(np.zeros(len(quantities), dtype=np.int64), order_dates, quantities))
+
+    @property
+    def value(self) -> pd.Series:
+        return self.position * self.prices
+
+    @property
+    def dividend_flows(self) -> pd.Series:
+        return self.position * self.dividends_per_share
+
+
+# Run-scoped timelines of every (portfolio, symbol, market) of a ledger. The history of an instrument is read once
+# from its first order in any portfolio to the end date, every portfolio holding it reads a view of it.
+class Timelines:
+    def __init__(self, orders: Ledger, end_date: Optional[dt.date] = None):
+        self.orders = orders
+        self.end_date = end_date or dt.date.today()
+        self._histories: Dict[Tuple[str, str], pd.DataFrame] = {}
+        self._timelines: Dict[Tuple[str, str, str], InstrumentTimeline] = {}
+
+    def history(self, sym: str, market: str, start_date=None) -> pd.DataFrame:
+        # From start_date on, a copy holding the rows a download from that date would have returned
+        if start_date is not None:
+            history = self.history(sym, market)
+            return history[history.index >= pd.Timestamp(start_date)].copy()
+        if (sym, market) not in self._histories:
+            rows = self.orders.rows((sym, market), OrderColumns.sym.value, OrderColumns.market.value)
+            # Ledger rows are in date order, the first one is the earliest
+            start_date = self.orders.df[OrderColumns.date.value].iloc[rows[0]]
+            self._histories[(sym, market)] = get_historical_prices_with_dates(sym, market, start_date, self.end_date)
+        return self._histories[(sym, market)]
+
+    def build(self, portfolio_keys: Optional[List[str]] = None):
+        # Positions of every (portfolio, symbol, market) of the given portfolios not built yet, all aligned to their
+        # instrument's trading days in one pass over the orders
+        columns = (OrderColumns.portfolio.value, OrderColumns.sym.value, OrderColumns.market.value)
+        portfolio_keys = None if portfolio_keys is None else set(portfolio_keys)
+        pending = [
+            (key, rows)
+            for key, rows in self.orders.groups(*columns)
+            if key not in self._timelines and (portfolio_keys is None or key[0] in portfolio_keys)
+        ]
+        if not pending:
+            return
+
+        histories = [self.history(sym, market) for (_, sym, market), _ in pending]
+        calendar = TradingCalendar([history.index for history in histories])
+        order_rows = np.concatenate([rows for _, rows in pending])
+        positions = calendar.cumulative(
+            np.repeat(np.arange(len(pending)), [len(rows) for _, rows in pending]),
+            self.orders.df[OrderColumns.date.value].to_numpy()[order_rows],
+            self.orders.df[OrderColumns.qty.value].to_numpy()[order_rows],
+        )
+        for i, ((key, _), history) in enumerate(zip(pending, histories)):
+            self._timelines[key] = InstrumentTimeline(history, calendar.slice(positions, i))
+
+    def timeline(self, portfolio: str, sym: str, market: str) -> InstrumentTimeline:
+        key = (portfolio, sym, market)
+        if key not in self._timelines:
+            self.build([portfolio])
+        return self._timelines[key]
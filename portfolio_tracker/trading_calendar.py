@@ -0,0 +1,47 @@
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def to_days(dates) -> np.ndarray:
+    # Day numbers since the epoch, the time of day dropped without going through python dates
+    return np.asarray(pd.DatetimeIndex(dates).values, dtype="datetime64[D]").astype(np.int64)
+
+
+# Trading days of several instruments laid end to end, the days of the i-th at slots offsets[i]:offsets[i + 1].
+# Dates are snapped to each instrument's calendar with a single searchsorted over all of them, on keys combining the
+# instrument and the day.
+class TradingCalendar:
+    def __init__(self, calendars: Sequence[pd.DatetimeIndex]):
+        days = [to_days(calendar) for calendar in calendars]
+        lengths = np.array([len(d) for d in days], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        days = np.concatenate(days) if len(days) else np.empty(0, dtype=np.int64)
+
+        # Each instrument gets a range of keys wide enough for every day of any calendar, plus one past the last
+        self._origin = days.min() if len(days) else 0
+        self._span = (days.max() - self._origin + 2) if len(days) else 1
+        self._keys = np.repeat(np.arange(len(lengths)) * self._span, lengths) + (days - self._origin)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def snap(self, instruments: np.ndarray, dates) -> np.ndarray:
+        # Slot of the first trading day of the instrument on or after each date, -1 past its last trading day
+        days = np.clip(to_days(dates) - self._origin, 0, self._span - 1)
+        slots = np.searchsorted(self._keys, instruments * self._span + days, side="left")
+        return np.where(slots < self.offsets[instruments + 1], slots, -1)
+
+    def cumulative(self, instruments: np.ndarray, dates, quantities: np.ndarray) -> np.ndarray:
+        # Running total of the quantities of each instrument as of each of its trading days. Quantities snapped to
+        # the same day are summed first, those past the last trading day are left out.
+        slots = self.snap(instruments, dates)
+        kept = slots >= 0
+        totals = np.bincount(slots[kept], weights=np.asarray(quantities, dtype=float)[kept], minlength=len(self))
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            np.cumsum(totals[start:end], out=totals[start:end])
+        return totals
+
+    def slice(self, values: np.ndarray, i: int) -> np.ndarray:
+        return values[self.offsets[i] : self.offsets[i + 1]]
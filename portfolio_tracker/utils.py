@@ -1,25 +1,76 @@
 import datetime as dt
+import hashlib
+import numpy as np
 import pandas as pd
-import xlwings as xw
-import yfinance as yf
 
-from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
-from portfolio_tracker.constant import MARKET_MAP
+from portfolio_tracker.constant import COST_BASIS_METHOD, MARKET_MAP, CostBasisMethod, OrderColumns
+from portfolio_tracker.fetcher import get_fetcher
+from portfolio_tracker.instrumentation import get_instrumentation, timed
+from portfolio_tracker.providers import get_fx_sym, get_provider
+from portfolio_tracker.store import get_metadata_store, get_price_store
 
+if TYPE_CHECKING:
+    import xlwings as xw
 
-def read_table(origin: str, sheet: xw.Sheet, **kwargs) -> pd.DataFrame:
+
+@timed("utils.read_table")
+def read_table(origin: str, sheet: "xw.Sheet", **kwargs) -> pd.DataFrame:
     df = sheet[origin].expand().options(pd.DataFrame, **kwargs).value
     return df
 
 
-def save_dataframe(df: pd.DataFrame, origin: str, sheet: xw.Sheet, **kwargs):
+@timed("utils.read_table_values")
+def read_table_values(sheet: "xw.Sheet", origin: str = "B2") -> List[List]:
+    # Raw values of the table at origin, header row first, in a single call
+    return sheet[origin].expand().options(ndim=2).value
+
+
+def table_values_to_frame(values: List[List]) -> pd.DataFrame:
+    # Same frame as read_table(origin, sheet, index=0, header=1) from the values read_table_values returned
+    if not values:
+        return pd.DataFrame()
+    return pd.DataFrame(values[1:], columns=values[0])
+
+
+@timed("utils.save_dataframe")
+def save_dataframe(df: pd.DataFrame, origin: str, sheet: "xw.Sheet", **kwargs):
     sheet[origin].expand().options(**kwargs).value = df
 
 
-def positive_weighted_average(group: pd.DataFrame, data_col: str, weight_col: str) -> float:
-    msk = group[weight_col] > 0
-    return (group.loc[msk, data_col] * group.loc[msk, weight_col]).sum() / group.loc[msk, weight_col].sum()
+def _canonical_value(value) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, "strftime"):
+        return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S").replace(" 00:00:00", "")
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return str(float(value))
+    return str(value).strip()
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    # Hash of each row once its values are rendered the same way whether they were parsed from a CSV or read back
+    # from the sheet, e.g. 12 and 12.0 or a date and its ISO string
+    canonical = {}
+    # Columns read back from the sheet hold python objects, typed first so that only mixed ones go cell by cell
+    for i, (_, column) in enumerate(df.infer_objects().items()):
+        if pd.api.types.is_datetime64_any_dtype(column):
+            canonical[i] = column.dt.strftime("%Y-%m-%d %H:%M:%S").str.replace(" 00:00:00", "").fillna("")
+        elif pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            canonical[i] = column.astype(float).astype(str).replace("nan", "")
+        elif pd.api.types.infer_dtype(column) == "string":
+            canonical[i] = column.str.strip().fillna("")
+        else:
+            canonical[i] = column.map(_canonical_value)
+    return pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False).to_numpy().view(np.int64)
+
+
+def count_table_rows(sheet, origin_row: int = 2, origin_column: int = 2) -> int:
+    # Number of rows below the header, without reading the table
+    if sheet.range((origin_row + 1, origin_column)).value is None:
+        return 0
+    return sheet.range((origin_row, origin_column)).end("down").row - origin_row
 
 
 def get_yfinance_sym(stock_sym: str, market_code: str) -> str:
@@ -29,39 +80,90 @@ def get_yfinance_sym(stock_sym: str, market_code: str) -> str:
     return tkr
 
 
-def get_company_info(stock_symbol, market_code):
-    tkr = get_yfinance_sym(stock_symbol, market_code)
-    ticker = yf.Ticker(tkr)
-    company_name = ticker.info["longName"]
-    local_currency = ticker.info["currency"]
-    return company_name, local_currency
+def read_through_store(tkr: str, start_date: dt.date, end_date: dt.date, fetch) -> pd.DataFrame:
+    # Network calls go through the shared fetcher so concurrent requests for the same range are coalesced
+    fetched = []
 
+    def fetch_once(tkr, start, end):
+        fetched.append((start, end))
+        if not get_provider().remote:
+            return fetch(tkr, start, end)
+        return get_fetcher().fetch(("history", tkr, start, end), fetch, tkr, start, end)
 
-@lru_cache()
-def get_today_forex_rates(base_currency: str, target_currency: str) -> pd.Series:
-    today_str = dt.date.today().strftime("%Y-%m-%d")
-    last_day_str = (dt.date.today() - dt.timedelta(days=5)).strftime("%Y-%m-%d")
-    forex_pair = base_currency + target_currency + "=X"  # Append "=X" to the currency pair for Yahoo Finance
-    forex_data = yf.download(forex_pair, start=last_day_str, end=today_str)
-    return forex_data["Close"].iloc[-1]
+    if get_provider().persistent:
+        df = get_price_store().get_history(tkr, start_date, end_date, fetch_once)
+        get_instrumentation().count("cache.prices.misses" if fetched else "cache.prices.hits")
+        return df
+    return fetch_once(tkr, start_date, end_date)
 
 
-@lru_cache()
-def get_forex_rates_series(
-    base_currency: str, target_currency: str, start_date: dt.date, end_date: dt.date
-) -> pd.Series:
-    start_str = start_date.strftime("%Y-%m-%d")
-    end_str = end_date.strftime("%Y-%m-%d")
-    forex_pair = base_currency + target_currency + "=X"  # Append "=X" to the currency pair for Yahoo Finance
-    forex_data = yf.download(forex_pair, start=start_str, end=end_str)
-    return forex_data["Close"]
+@timed("utils.get_fx_history")
+def get_fx_history(base_currency: str, target_currency: str, start_date: dt.date, end_date: dt.date) -> pd.DataFrame:
+    provider = get_provider()
+    return read_through_store(
+        get_fx_sym(base_currency, target_currency),
+        start_date,
+        end_date,
+        lambda _, start, end: provider.fx_history(base_currency, target_currency, start, end),
+    )
 
 
-@lru_cache()
+def get_company_info(stock_symbol, market_code):
+    return get_company_infos([(stock_symbol, market_code)])[(stock_symbol, market_code)]
+
+
+@timed("utils.get_company_infos")
+def get_company_infos(instruments: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    # Name and currency are served from the metadata store while fresh, the remaining requests are all queued on
+    # the fetcher's pool before waiting on the first one
+    fetcher = get_fetcher()
+    provider = get_provider()
+    metadata_store = get_metadata_store() if provider.persistent else None
+
+    infos, futures = {}, {}
+    for stock_symbol, market_code in instruments:
+        tkr = get_yfinance_sym(stock_symbol, market_code)
+        cached = metadata_store.get(tkr) if metadata_store is not None else None
+        if metadata_store is not None:
+            get_instrumentation().count("cache.metadata.misses" if cached is None else "cache.metadata.hits")
+        if cached is not None:
+            infos[(stock_symbol, market_code)] = cached
+        elif not provider.remote:
+            info = provider.info(tkr)
+            infos[(stock_symbol, market_code)] = (info["longName"], info["currency"])
+        else:
+            futures[(stock_symbol, market_code)] = (tkr, fetcher.submit(("info", tkr), provider.info, tkr))
+
+    for instrument, (tkr, future) in futures.items():
+        company_name, local_currency = future.result()["longName"], future.result()["currency"]
+        if metadata_store is not None:
+            metadata_store.put(tkr, company_name, local_currency)
+        infos[instrument] = (company_name, local_currency)
+    return infos
+
+
+@timed("utils.get_historical_prices_with_dates")
 def get_historical_prices_with_dates(
     stock_symbol: str, market_code: str, start_date: dt.date, end_date: dt.date
 ) -> pd.DataFrame:
     tkr = get_yfinance_sym(stock_symbol, market_code)
-    ticker = yf.Ticker(tkr)
-    historical_data = ticker.history(start=start_date, end=end_date)
-    return historical_data
+    return read_through_store(tkr, start_date, end_date, get_provider().history)
+
+
+def get_latest_market_date(portfolio_order_df: pd.DataFrame) -> pd.Timestamp:
+    instruments = portfolio_order_df[[OrderColumns.sym.value, OrderColumns.market.value]].drop_duplicates()
+    today = dt.date.today()
+    return max(
+        get_historical_prices_with_dates(sym, market, today - dt.timedelta(days=10), today).index.max()
+        for sym, market in instruments.itertuples(index=False)
+    )
+
+
+def fingerprint_portfolio(
+    portfolio_order_df: pd.DataFrame, book_currency: str, cost_basis_method: CostBasisMethod = COST_BASIS_METHOD
+) -> str:
+    # Insensitive to the order of the rows, changes with any edited order, a new market close or another cost basis
+    row_hashes = np.sort(pd.util.hash_pandas_object(portfolio_order_df, index=False).to_numpy())
+    digest = hashlib.sha256(row_hashes.tobytes())
+    digest.update(f"{book_currency}|{get_latest_market_date(portfolio_order_df)}|{cost_basis_method.value}".encode())
+    return digest.hexdigest()
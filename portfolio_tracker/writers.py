@@ -0,0 +1,367 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from portfolio_tracker.charts import Chart, chart_key, render_charts
+from portfolio_tracker.instrumentation import get_instrumentation
+from portfolio_tracker.store import get_chart_cache
+from portfolio_tracker.utils import read_table, read_table_values, save_dataframe
+
+if TYPE_CHECKING:
+    import xlwings as xw
+
+
+# Destination of the tables, cells and charts of one sheet, so the pipeline runs the same with or without Excel
+class SheetWriter(ABC):
+    def __init__(self, name: str):
+        self.name = name
+        self.charts: Dict[str, Chart] = {}
+
+    @abstractmethod
+    def write_table(self, df: pd.DataFrame, origin: str, index: bool = False):
+        pass
+
+    @abstractmethod
+    def write_value(self, cell: str, value, color: Optional[Tuple[int, int, int]] = None):
+        pass
+
+    def add_chart(self, name: str, draw: Callable, **kwargs):
+        # Rendered with the workbook's other charts on close, a chart replaces any earlier one of the same name
+        self.charts[name] = (draw, kwargs)
+
+    @abstractmethod
+    def add_picture(self, image: bytes, name: str, key: Optional[str] = None):
+        # `key` is the content address of the image, a writer can skip replacing a picture placed with the same key
+        pass
+
+    def flush(self):
+        pass
+
+
+class WorkbookWriter(ABC):
+    round_trips = 0
+
+    def __init__(self):
+        self._sheets: Dict[str, SheetWriter] = {}
+        self.charts_rendered = 0
+        self.charts_from_cache = 0
+
+    def sheet(self, name: str, create: bool = False) -> SheetWriter:
+        # `create` adds the sheet to the user's workbook when it is missing, otherwise a missing sheet is an error.
+        # Writers producing a new output file always create their sheets.
+        if name not in self._sheets:
+            self._sheets[name] = self._make_sheet(name, create)
+        return self._sheets[name]
+
+    @abstractmethod
+    def _make_sheet(self, name: str, create: bool) -> SheetWriter:
+        pass
+
+    def close(self):
+        instrumentation = get_instrumentation()
+        with instrumentation.stage("writer.flush"):
+            for sheet in self._sheets.values():
+                sheet.flush()
+
+        # Charts drawn from the same data as a previous run are served from the chart cache, the others are rendered
+        # at once and every picture is then inserted in a single pass
+        chart_cache = get_chart_cache()
+        charts = [(sheet, name, chart) for sheet in self._sheets.values() for name, chart in sheet.charts.items()]
+        keys = [chart_key(*chart) for _, _, chart in charts]
+        images = [chart_cache.get(key) for key in keys]
+        missing = [i for i, image in enumerate(images) if image is None]
+        with instrumentation.stage("writer.render_charts"):
+            rendered = render_charts([charts[i][2] for i in missing])
+        for i, image in zip(missing, rendered):
+            chart_cache.put(keys[i], image)
+            images[i] = image
+        with instrumentation.stage("writer.add_pictures"):
+            for (sheet, name, _), key, image in zip(charts, keys, images):
+                sheet.add_picture(image, name, key)
+        for sheet in self._sheets.values():
+            sheet.charts = {}
+        chart_cache.prune()
+
+        self.charts_rendered += len(missing)
+        self.charts_from_cache += len(charts) - len(missing)
+        instrumentation.count("cache.charts.misses", len(missing))
+        instrumentation.count("cache.charts.hits", len(charts) - len(missing))
+
+
+def _cell_position(cell: str) -> Tuple[int, int]:
+    match = re.fullmatch(r"([A-Z]+)([0-9]+)", cell.upper())
+    column = 0
+    for letter in match.group(1):
+        column = column * 26 + ord(letter) - ord("A") + 1
+    return int(match.group(2)), column
+
+
+def _contiguous_blocks(cells: Dict[Tuple[int, int], object], key=lambda value: None) -> List[List[Tuple[int, int]]]:
+    # Groups cells into rectangles: runs of adjacent cells on a row, then runs of rows spanning the same columns.
+    # Cells only end up in the same block when `key` is equal for all of them.
+    runs = []
+    for row, column in sorted(cells):
+        run = runs[-1] if runs else None
+        if run is not None and run[-1] == (row, column - 1) and key(cells[run[-1]]) == key(cells[(row, column)]):
+            run.append((row, column))
+        else:
+            runs.append([(row, column)])
+
+    blocks = []
+    for run in runs:
+        block = next(
+            (
+                block
+                for block in blocks
+                if block[-1][0][0] == run[0][0] - 1
+                and [c for _, c in block[-1]] == [c for _, c in run]
+                and key(cells[block[-1][0]]) == key(cells[run[0]])
+            ),
+            None,
+        )
+        if block is None:
+            blocks.append([run])
+        else:
+            block.append(run)
+    return [[cell for run in block for cell in run] for block in blocks]
+
+
+# Values and formats are queued per sheet and written as contiguous 2D blocks on flush, every call made to Excel
+# is counted in `round_trips`
+class XlwingsSheetWriter(SheetWriter):
+    def __init__(self, sheet: "xw.Sheet"):
+        super().__init__(sheet.name)
+        self.xw_sheet = sheet
+        self.round_trips = 0
+        self._values: Dict[Tuple[int, int], object] = {}
+        self._formats: Dict[Tuple[int, int], Tuple] = {}
+        self._tables: List[Tuple[pd.DataFrame, str, bool]] = []
+        self._location = None
+
+    def read_table(self, origin: str, **kwargs) -> pd.DataFrame:
+        self.flush()
+        self.round_trips += 1
+        return read_table(origin, self.xw_sheet, **kwargs)
+
+    def read_table_values(self, origin: str) -> List[List]:
+        self.flush()
+        self.round_trips += 1
+        return read_table_values(self.xw_sheet, origin)
+
+    def read_value(self, cell: str):
+        position = _cell_position(cell)
+        if position in self._values:
+            return self._values[position]
+        self.round_trips += 1
+        return self.xw_sheet.range(cell).value
+
+    def write_table(self, df: pd.DataFrame, origin: str, index: bool = False):
+        self._tables.append((df, origin, index))
+
+    def write_value(self, cell: str, value, color: Optional[Tuple[int, int, int]] = None):
+        self._values[_cell_position(cell)] = value
+        if color is not None:
+            self.set_format(cell, color=color)
+
+    def set_format(self, cell: str, color: Optional[Tuple[int, int, int]] = None, font_color: Optional[int] = None):
+        position = _cell_position(cell)
+        previous_color, previous_font_color = self._formats.get(position, (None, None))
+        self._formats[position] = (
+            previous_color if color is None else color,
+            previous_font_color if font_color is None else font_color,
+        )
+
+    def add_dropdown(self, cell: str, options: List[str]):
+        self.flush()
+        validation = self.xw_sheet.range(cell).api.Validation
+        validation.Delete()
+        validation.Add(Type=3, AlertStyle=2, Operator=1, Formula1=", ".join(options))
+        validation.IgnoreBlank = True
+        validation.InCellDropdown = True
+        self.round_trips += 6
+
+    def add_picture(self, image: bytes, name: str, key: Optional[str] = None):
+        chart_cache = get_chart_cache()
+        if self._location is None:
+            self._location = f"{self.xw_sheet.book.fullname}|{self.name}"
+            self.round_trips += 1
+        location = f"{self._location}|{name}"
+        if key is not None and chart_cache.placed(location) == key:
+            self.round_trips += 1
+            if name in self.xw_sheet.pictures:
+                return
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chart.png")
+            with open(path, "wb") as f:
+                f.write(image)
+            self.xw_sheet.pictures.add(path, name=name, update=True)
+        self.round_trips += 1
+        if key is not None:
+            chart_cache.mark_placed(location, key)
+
+    def flush(self):
+        for df, origin, index in self._tables:
+            save_dataframe(df, origin, self.xw_sheet, index=index)
+            self.round_trips += 1
+        self._tables = []
+
+        for block in _contiguous_blocks(self._values):
+            (first_row, first_column), (last_row, last_column) = block[0], block[-1]
+            rows = [
+                [self._values[(row, column)] for column in range(first_column, last_column + 1)]
+                for row in range(first_row, last_row + 1)
+            ]
+            self.xw_sheet.range((first_row, first_column), (last_row, last_column)).value = rows
+            self.round_trips += 1
+        self._values = {}
+
+        for block in _contiguous_blocks(self._formats, key=lambda fmt: fmt):
+            color, font_color = self._formats[block[0]]
+            cells = self.xw_sheet.range(block[0], block[-1])
+            if color is not None:
+                cells.color = color
+                self.round_trips += 1
+            if font_color is not None:
+                cells.api.Font.Color = font_color
+                self.round_trips += 1
+        self._formats = {}
+
+
+# Screen updating and automatic calculation are suspended from creation until `close`, which flushes every sheet
+class XlwingsWorkbookWriter(WorkbookWriter):
+    def __init__(self, wb: "xw.Book"):
+        super().__init__()
+        self.wb = wb
+        self._screen_updating = wb.app.screen_updating
+        self._calculation = wb.app.calculation
+        wb.app.screen_updating = False
+        wb.app.calculation = "manual"
+        self._app_round_trips = 4
+
+    def _make_sheet(self, name: str, create: bool) -> SheetWriter:
+        if create and name not in [sheet.name for sheet in self.wb.sheets]:
+            self.wb.sheets.add(name, after=self.wb.sheets[-1])
+        return XlwingsSheetWriter(self.wb.sheets[name])
+
+    @property
+    def round_trips(self) -> int:
+        return self._app_round_trips + sum(sheet.round_trips for sheet in self._sheets.values())
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.wb.app.calculation = self._calculation
+            self.wb.app.screen_updating = self._screen_updating
+            self._app_round_trips += 2
+
+
+# Writes each sheet to its own directory: tables as CSV named after their origin cell, charts as PNG and
+# single cells in cells.json
+class FileSheetWriter(SheetWriter):
+    def __init__(self, name: str, directory: str):
+        super().__init__(name)
+        self.directory = directory
+        self.cells = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def write_table(self, df: pd.DataFrame, origin: str, index: bool = False):
+        df.to_csv(os.path.join(self.directory, f"{origin}.csv"), index=index)
+
+    def write_value(self, cell: str, value, color: Optional[Tuple[int, int, int]] = None):
+        self.cells[cell] = value
+        with open(os.path.join(self.directory, "cells.json"), "w") as f:
+            json.dump(self.cells, f, indent=2, default=str)
+
+    def add_picture(self, image: bytes, name: str, key: Optional[str] = None):
+        path = os.path.join(self.directory, f"{name}.png")
+        chart_cache = get_chart_cache()
+        if key is not None and chart_cache.placed(os.path.abspath(path)) == key and os.path.exists(path):
+            return
+        with open(path, "wb") as f:
+            f.write(image)
+        if key is not None:
+            chart_cache.mark_placed(os.path.abspath(path), key)
+
+
+class FileWorkbookWriter(WorkbookWriter):
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    def _make_sheet(self, name: str, create: bool) -> SheetWriter:
+        return FileSheetWriter(name, os.path.join(self.directory, name))
+
+
+# Writes into an openpyxl worksheet, charts are stacked in a column to the right of the tables
+class OpenpyxlSheetWriter(SheetWriter):
+    def __init__(self, ws, picture_anchor_column: str = "T"):
+        super().__init__(ws.title)
+        self.ws = ws
+        self.picture_anchor_column = picture_anchor_column
+        self._picture_row = None
+
+    def write_table(self, df: pd.DataFrame, origin: str, index: bool = False):
+        from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+        if index:
+            df = df.reset_index()
+        column, row = coordinate_from_string(origin)
+        column = column_index_from_string(column)
+        for j, header in enumerate(df.columns):
+            self.ws.cell(row=row, column=column + j, value=str(header))
+        for i, values in enumerate(df.itertuples(index=False), start=1):
+            for j, value in enumerate(values):
+                value = None if pd.isna(value) else value
+                if isinstance(value, pd.Timestamp):
+                    value = value.to_pydatetime()
+                self.ws.cell(row=row + i, column=column + j, value=value)
+
+    def write_value(self, cell: str, value, color: Optional[Tuple[int, int, int]] = None):
+        from openpyxl.styles import PatternFill
+
+        self.ws[cell].value = value
+        if color is not None:
+            rgb = "%02X%02X%02X" % color
+            self.ws[cell].fill = PatternFill(start_color=rgb, end_color=rgb, fill_type="solid")
+
+    def add_picture(self, image: bytes, name: str, key: Optional[str] = None):
+        from openpyxl.drawing.image import Image
+
+        if self._picture_row is None:
+            # The charts a template sheet holds are those of its last run, they are replaced rather than drawn over.
+            # openpyxl has no public way to remove an image.
+            self.ws._images = []
+            self._picture_row = 2
+        image = Image(io.BytesIO(image))
+        self.ws.add_image(image, f"{self.picture_anchor_column}{self._picture_row}")
+        self._picture_row += int(image.height / 20) + 2
+
+
+class OpenpyxlWorkbookWriter(WorkbookWriter):
+    def __init__(self, output_path: str, template_path: Optional[str] = None):
+        from openpyxl import Workbook, load_workbook
+
+        super().__init__()
+        self.output_path = output_path
+        if template_path is not None:
+            shutil.copyfile(template_path, output_path)
+            self.wb = load_workbook(output_path, keep_vba=output_path.endswith(".xlsm"))
+        else:
+            self.wb = Workbook()
+
+    def _make_sheet(self, name: str, create: bool) -> SheetWriter:
+        ws = self.wb[name] if name in self.wb.sheetnames else self.wb.create_sheet(name)
+        return OpenpyxlSheetWriter(ws)
+
+    def close(self):
+        super().close()
+        self.wb.save(self.output_path)